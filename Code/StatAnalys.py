@@ -1,137 +1,183 @@
+import copy
+import functools
+
 import pandas as pd
 import numpy as np
 import plotly.express as px
 
+import stream
+from align import Aligned
+from loader import csv_path
+from profiler import count, stage, timed
+from render import queued
+from stats import summarize, table
 
-class Base:
+# the only columns the summaries, histograms and correlation read; compact datasets keep just these
+FIELDS = ('Volume', 'Pct Change', 'Up Day', 'Same Direction')
 
-    def __init__(self, csv1, csv2, csv3, csv4):
-        self.names = [csv1, csv2, csv3, csv4]
-        self.csva = pd.read_csv(f'{csv1}.csv')
-        self.csvb = pd.read_csv(f'{csv2}.csv')
-        self.csvc = pd.read_csv(f'{csv3}.csv')
-        self.csvd = pd.read_csv(f'{csv4}.csv')
-        self.csvs = [self.csva, self.csvb, self.csvc, self.csvd]
 
-        # find avg price, pct change, if traded up (1,0), if traded in same direction as previous session (1,0)
-        for csv in self.csvs:
-            csv['Avg Price'] = (csv['High'] + csv['Low'] + csv['Close']) / 3
-            csv['Pct Change'] = csv['Avg Price'].pct_change()
-            csv['Up Day'] = (csv['Pct Change'] > 0) * 1
-            csv['Same Direction'] = (csv['Up Day'] == csv['Up Day'].shift()) * 1
+class ConditionIndex:
 
-        # merge all datasets into one
-        temp1 = pd.merge(self.csva, self.csvb, on='Date', suffixes=(f'_{csv1}', f'_{csv2}'))
-        temp2 = pd.merge(self.csvc, self.csvd, on='Date', suffixes=(f'_{csv3}', f'_{csv4}'))
-        self.combined = pd.merge(temp1, temp2, on='Date')
-
-        # trim all individual datasets to same size
-        length = len(self.combined)
-        self.csva = self.csva.tail(length)
-        self.csvb = self.csvb.tail(length)
-        self.csvc = self.csvc.tail(length)
-        self.csvd = self.csvd.tail(length)
-        self.csvs = [self.csva, self.csvb, self.csvc, self.csvd]
+    # row indexes of one dataset grouped by state = 2 * Up Day + Same Direction (one stable sort),
+    # so any combination of conditions is a lookup rather than a masked copy of the frame
+    def __init__(self, csv):
+        state = 2 * csv['Up Day'].to_numpy().astype(np.int64) + csv['Same Direction'].to_numpy()
+        self.order = np.argsort(state, kind='stable')
+        self.bounds = np.searchsorted(state[self.order], np.arange(5))
 
-    def add_condition(self, uponly=None, samebefore=None):
-        if uponly is not None:
-            self.csva = self.csva[self.csva['Up Day'] == uponly]
-            self.csvb = self.csvb[self.csvb['Up Day'] == uponly]
-            self.csvc = self.csvc[self.csvc['Up Day'] == uponly]
-            self.csvd = self.csvd[self.csvd['Up Day'] == uponly]
-            self.csvs = [self.csva, self.csvb, self.csvc, self.csvd]
-            for i in range(len(self.names)):
-                self.names[i] = self.names[i] + f'_{uponly}up'
+    # sorted rows matching the condition (None matches either value)
+    def rows(self, uponly=None, samebefore=None):
+        states = [s for s in range(4)
+                  if (uponly is None or s // 2 == uponly) and (samebefore is None or s % 2 == samebefore)]
+        if len(states) == 4:
+            return np.arange(len(self.order))
+        return np.sort(np.concatenate([self.order[self.bounds[s]:self.bounds[s + 1]] for s in states]))
 
-        if samebefore is not None:
-            self.csva = self.csva[self.csva['Same Direction'] == samebefore]
-            self.csvb = self.csvb[self.csvb['Same Direction'] == samebefore]
-            self.csvc = self.csvc[self.csvc['Same Direction'] == samebefore]
-            self.csvd = self.csvd[self.csvd['Same Direction'] == samebefore]
-            self.csvs = [self.csva, self.csvb, self.csvc, self.csvd]
-            for i in range(len(self.names)):
-                self.names[i] = self.names[i] + f'_{samebefore}samebefore'
-
-    # create df summarizing mean, std dev, min, max, and abs min of each dataset
-    def summarize_change(self):
-        columns = ['Name', 'Median', 'Mean', 'Std. Deviation', 'Min', 'Max', 'Absolute Min']
-        change_table = pd.DataFrame(columns=columns)
-        for i in range(len(self.csvs)):
-            median = round(self.csvs[i]['Pct Change'].median(), 6)
-            mean = round(self.csvs[i]['Pct Change'].mean(), 6)
-            std_dev = round(self.csvs[i]['Pct Change'].std(), 6)
-            min = round(self.csvs[i]['Pct Change'].min(), 6)
-            max = round(self.csvs[i]['Pct Change'].max(), 6)
-            abs_min = round(self.csvs[i]['Pct Change'].abs().min(), 6)
-            temp = {'Name': self.names[i], 'Median': median, 'Mean': mean, 'Std. Deviation': std_dev, 'Min': min,
-                    'Max': max,
-                    'Absolute Min': abs_min}
-            change_table = change_table.append(temp, ignore_index=True)
-        return change_table
+
+class Summaries:
+
+    # the summary tables shared by Base and StreamedBase; subclasses set self.names and provide
+    # summaries(name, pool=None, nonzero=False), one stats.Summary of a column per dataset
+
+    # create df summarizing median, mean, std dev, min, max, and abs min of each dataset
+    @timed()
+    def summarize_change(self, pool=None):
+        columns = ['Median', 'Mean', 'Std. Deviation', 'Min', 'Max', 'Absolute Min']
+        return table(self.names, self.summaries('Pct Change', pool), columns).round(6)
 
     # create df summarizing mean, std dev, min, max, and quartiles of Volume
     # NOTE: ZERO VALUES ARE OMITTED FROM CALCULATIONS
-    def summarize_volume(self):
-        columns = ['Name', 'Median', 'Mean', 'Std. Deviation', 'Min', 'Max',
+    @timed()
+    def summarize_volume(self, pool=None):
+        columns = ['Median', 'Mean', 'Std. Deviation', 'Min', 'Max',
                    '25th percentile', '50th percentile', '75th percentile']
-        volume_table = pd.DataFrame(columns=columns)
-        for i in range(len(self.csvs)):
-            nozero = self.csvs[i]['Volume'].replace(0, np.nan)
-            median = nozero.median()
-            mean = nozero.mean()
-            std_dev = nozero.std()
-            min = nozero.min()
-            max = nozero.max()
-            twentyfif = nozero.quantile(.25)
-            fidyth = nozero.quantile(.5)
-            sevendyfif = nozero.quantile(.75)
-            temp = {'Name': self.names[i], 'Median': median, 'Mean': mean, 'Std. Deviation': std_dev, 'Min': min,
-                    'Max': max,
-                    '25th percentile': twentyfif, '50th percentile': fidyth, '75th percentile': sevendyfif}
-            volume_table = volume_table.append(temp, ignore_index=True)
-        return volume_table
+        return table(self.names, self.summaries('Volume', pool, nonzero=True), columns)
 
     # summarizes mean + std dev of binomial variables
-    def summarize_binomial(self):
-        columns = ['Name', 'Pct. Up Day', 'Up Day Std. Deviation', 'Pct. Same Direct.', 'Same Direct. Std. Deviation']
-        binomial_table = pd.DataFrame(columns=columns)
-        for i in range(len(self.csvs)):
-            pct_up = round(self.csvs[i]['Up Day'].mean(), 4)
-            std_up = round(self.csvs[i]['Up Day'].std(), 4)
-            pct_same = round(self.csvs[i]['Same Direction'].mean(), 4)
-            std_same = round(self.csvs[i]['Same Direction'].std(), 4)
-            temp = {'Name': self.names[i], 'Pct. Up Day': pct_up, 'Up Day Std. Deviation': std_up,
-                    'Pct. Same Direct.': pct_same, 'Same Direct. Std. Deviation': std_same}
-            binomial_table = binomial_table.append(temp, ignore_index=True)
-        return binomial_table
+    @timed()
+    def summarize_binomial(self, pool=None):
+        up = self.summaries('Up Day', pool)
+        same = self.summaries('Same Direction', pool)
+        binomial_table = pd.DataFrame({
+            'Name': self.names,
+            'Pct. Up Day': [summary.mean for summary in up],
+            'Up Day Std. Deviation': [summary.std for summary in up],
+            'Pct. Same Direct.': [summary.mean for summary in same],
+            'Same Direct. Std. Deviation': [summary.std for summary in same],
+        })
+        return binomial_table.round(4)
+
+
+class Base(Summaries):
+
+    # compact=True keeps only FIELDS, as float32 / int8, and the per-dataset frames are views of the aligned
+    # columns instead of copies (see Aligned); complete_set.csv then only has those columns
+    def __init__(self, *names, compact=False):
+        self.names = list(names)
+
+        # load with avg price, pct change, if traded up (1,0), if traded in same direction as previous session (1,0)
+        # and line every dataset up on the days they all traded
+        with stage('Base.load', tickers=len(self.names)):
+            self.aligned = Aligned(self.names, FIELDS, compact=True) if compact else Aligned(self.names)
+        count('rows processed', len(self.aligned.days) * len(self.names))
+
+        # merge all datasets into one
+        with stage('Base.merge'):
+            self.combined = self.aligned.combined()
+
+        # trim all individual datasets to the same days
+        with stage('Base.trim'):
+            self.csvs = self.aligned.trimmed()
+
+        # rows of each dataset in every Up Day x Same Direction state, built once and shared by every condition
+        with stage('Base.condition index'):
+            self.states = [ConditionIndex(csv) for csv in self.csvs]
+        # rows kept by the current condition (None = all rows)
+        self.rows = None
+
+    # returns a view of the datasets restricted to the condition, leaving this object untouched
+    # views only hold row indexes into the shared frames, and conditions can be chained
+    def add_condition(self, uponly=None, samebefore=None):
+        view = copy.copy(self)
+        view.names = list(self.names)
+        view.rows = []
+        for i, states in enumerate(self.states):
+            rows = states.rows(uponly, samebefore)
+            view.rows.append(rows if self.rows is None else np.intersect1d(self.rows[i], rows, assume_unique=True))
+
+        if uponly is not None:
+            for i in range(len(view.names)):
+                view.names[i] = view.names[i] + f'_{uponly}up'
+
+        if samebefore is not None:
+            for i in range(len(view.names)):
+                view.names[i] = view.names[i] + f'_{samebefore}samebefore'
+        return view
+
+    # values of one column of dataset i under the current condition
+    def column(self, i, name):
+        values = self.csvs[i][name].to_numpy()
+        return values if self.rows is None else values[self.rows[i]]
+
+    # dataset i under the current condition, as its own frame
+    def subset(self, i):
+        return self.csvs[i] if self.rows is None else self.csvs[i].iloc[self.rows[i]]
+
+    # one stats.Summary of column `name` per dataset under the current condition, zeros left out if nonzero
+    # every dataset is summarized in one pass; pass a pool to do them in parallel
+    def summaries(self, name, pool=None, nonzero=False):
+        series = [self.column(i, name) for i in range(len(self.csvs))]
+        if nonzero:
+            series = [np.where(values == 0, np.nan, values.astype(np.float64)) for values in series]
+        return summarize(series, pool)
 
     # histogram of change
-    def change_histogram(self):
-        for i in range(len(self.csvs)):
-            fig = px.histogram(self.csvs[i]['Pct Change'], x='Pct Change', title=f'{self.names[i]} Pct. Change')
-            fig.write_image(f'{self.names[i]}_histogram_change.png')
+    @timed()
+    def change_histogram(self, queue=None):
+        with queued(queue) as queue:
+            for i in range(len(self.csvs)):
+                fig = px.histogram(self.subset(i)['Pct Change'], x='Pct Change', title=f'{self.names[i]} Pct. Change')
+                queue.add(fig, f'{self.names[i]}_histogram_change.png')
 
     # histogram of volume
     # NOTE: ZERO VALUES ARE OMITTED FROM COUNT
-    def volume_histogram(self):
-        for i in range(len(self.csvs)):
-            df = self.csvs[i]['Volume'].replace(0, np.nan)
-            fig = px.histogram(df, x='Volume', title=f'{self.names[i]} Volume')
-            fig.write_image(f'{self.names[i]}_volume_change.png')
-
+    @timed()
+    def volume_histogram(self, queue=None):
+        with queued(queue) as queue:
+            for i in range(len(self.csvs)):
+                df = self.subset(i)['Volume'].replace(0, np.nan)
+                fig = px.histogram(df, x='Volume', title=f'{self.names[i]} Volume')
+                queue.add(fig, f'{self.names[i]}_volume_change.png')
+
+    @timed()
     def correlation(self):
-        newone = self.combined.filter(
-            ['Volume_^DJI', 'Pct Change_^DJI', 'Up Day_^DJI', 'Same Direction_^DJI', 'Volume_^GSPC',
-             'Pct Change_^GSPC', 'Up Day_^GSPC', 'Same Direction_^GSPC', 'Volume_^NYA',
-             'Pct Change_^NYA', 'Up Day_^NYA', 'Same Direction_^NYA', 'Volume_^IXIC',
-             'Pct Change_^IXIC', 'Up Day_^IXIC', 'Same Direction_^IXIC'], axis=1)
+        columns = [f'{field}_{name}' for name in self.aligned.tickers
+                   for field in ['Volume', 'Pct Change', 'Up Day', 'Same Direction']]
+        newone = self.combined.filter(columns, axis=1)
         newone.corr().to_csv('correlation.csv')
 
 
+class StreamedBase(Summaries):
+
+    # Base's summary tables fed straight from the csvs in chunks (stream.summarize), never holding a dataset
+    # in memory; each dataset is summarized over its own rows in the start/end range (then the last `period`)
+    # rather than the days they all traded. Only the summaries stream: conditions, histograms and correlation
+    # need the aligned datasets, so use Base for those
+    def __init__(self, *names, chunksize=stream.CHUNKSIZE, start=None, end=None, period=None, directory='.'):
+        self.names = list(names)
+        self.paths = [csv_path(name, directory) for name in self.names]
+        self.options = {'chunksize': chunksize, 'start': start, 'end': end, 'period': period}
+
+    def summaries(self, name, pool=None, nonzero=False):
+        one = functools.partial(stream.summarize, column=name, nonzero=nonzero, **self.options)
+        with stage('StreamedBase.summaries', column=name, tickers=len(self.paths)):
+            return list((pool.map if pool is not None else map)(one, self.paths))
+
+
 # main method
 def main():
     # initialize obj DJI = dow, GSPC = S&P500, NYA = NYSE, IXIC = NASDAQ
-    dataset = Base(csv1='^DJI', csv2='^GSPC', csv3='^NYA', csv4='^IXIC')
+    dataset = Base('^DJI', '^GSPC', '^NYA', '^IXIC')
 
     # downloads summaries as csv
     # dataset.summarize_change().to_csv('change.csv')
@@ -150,4 +196,5 @@ def main():
 ########################################################################################################################
 
 
-main()
+if __name__ == '__main__':
+    main()
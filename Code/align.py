@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+import features
+import loader
+from profiler import count
+
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Avg Price', 'Pct Change', 'Up Day', 'Same Direction')
+INTEGER = {'Volume': np.int64, 'Up Day': np.int8, 'Same Direction': np.int8}
+
+
+# '^GSPC' -> 'GSPC', for file names and plot labels
+def label(ticker):
+    return ticker.lstrip('^')
+
+
+# ('^DJI', '^GSPC') -> 'DJI-GSPC'
+def pair_label(a, b):
+    return f'{label(a)}-{label(b)}'
+
+
+# days since epoch, used as the merge key instead of date strings
+def day_keys(dates):
+    return np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+
+
+# days present in every key array, found with a single sort over all the (already sorted) runs
+# each ticker lists a day at most once, so a day shared by all k tickers shows up as a run of k equal keys;
+# a key array that repeats a day (or is out of order) would fake a shared day, so it raises instead
+# names label the key arrays in that error
+def common_days(keys, names=None):
+    for i, key in enumerate(keys):
+        bad = np.flatnonzero(key[1:] <= key[:-1])
+        if len(bad):
+            name = i if names is None else names[i]
+            day = np.datetime64(int(key[bad[0] + 1]), 'D')
+            raise ValueError(f'{name}: dates must be unique and increasing, found {day} after '
+                             f'{np.datetime64(int(key[bad[0]]), "D")}')
+    k = len(keys)
+    merged = np.sort(np.concatenate(keys), kind='stable')
+    if k == 1:
+        return merged
+    shared = merged[k - 1:] == merged[:len(merged) - k + 1]
+    return merged[k - 1:][shared]
+
+
+class Aligned:
+
+    # load any number of tickers and line them up on the days they all traded
+    # block is (fields x days x tickers) so every field is a contiguous days x tickers matrix
+    # compact=True instead keeps every field in its own column-major days x tickers array of the narrowest
+    # dtype that holds it (float32 prices and returns, int8 flags, int64 volume), and trimmed()/combined()
+    # hand out views of those arrays rather than copies
+    def __init__(self, tickers, fields=FIELDS, directory='.', dtype=np.float64, compact=False):
+        self.tickers = list(tickers)
+        self.fields = list(fields)
+        self.compact = compact
+        dtype = np.float32 if compact else dtype
+        # the dates first, so no ticker's frame (and the files it maps) is held while the others load
+        keys = [day_keys(loader.load_arrays(ticker, directory, ['Date'])['Date']) for ticker in self.tickers]
+        self.days = common_days(keys, self.tickers)
+        self.dates = self.days.astype('datetime64[D]').astype(loader.COLUMNS['Date'])
+        count('rows aligned', len(self.days) * len(self.tickers))
+
+        shape = (len(self.days), len(self.tickers))
+        if compact:
+            self.block = None
+            self.columns = {field: np.empty(shape, INTEGER.get(field, dtype), order='F') for field in self.fields}
+        else:
+            self.block = np.empty((len(self.fields),) + shape, dtype)
+            self.columns = {field: self.block[i] for i, field in enumerate(self.fields)}
+        # then each frame in turn, gathered on the shared days and dropped
+        # its rows are found again in case the csv was appended to since its dates were read
+        for j, ticker in enumerate(self.tickers):
+            df = features.frame(ticker, directory, dtype=dtype)
+            key = day_keys(df['Date'].to_numpy())
+            rows = np.searchsorted(key, self.days)
+            if len(rows) and (rows[-1] >= len(key) or (key[rows] != self.days).any()):
+                raise ValueError(f'{ticker}: history changed while it was being aligned')
+            for field in self.fields:
+                self.columns[field][:, j] = df[field].to_numpy()[rows]
+            del df
+
+    # days x tickers matrix for one field
+    def column(self, field):
+        return self.columns[field]
+
+    # each ticker's aligned fields on the shared days, like its own frame trimmed to them
+    # (compact: views of the aligned columns)
+    def trimmed(self):
+        frames = []
+        for j in range(len(self.tickers)):
+            data = {'Date': self.dates}
+            for field in self.fields:
+                values = self.columns[field][:, j]
+                if not self.compact and field in INTEGER:
+                    values = values.astype(INTEGER[field])
+                data[field] = values
+            frames.append(pd.DataFrame(data, copy=not self.compact))
+        return frames
+
+    # wide frame with one '<field>_<ticker>' column per ticker and field, like a chain of pd.merge on Date
+    def combined(self):
+        data = {'Date': self.dates}
+        for j, ticker in enumerate(self.tickers):
+            for field in self.fields:
+                values = self.columns[field][:, j]
+                if not self.compact and field in INTEGER:
+                    values = values.astype(INTEGER[field])
+                data[f'{field}_{ticker}'] = values
+        return pd.DataFrame(data, copy=not self.compact)
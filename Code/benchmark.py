@@ -0,0 +1,454 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import features
+import loader
+from align import Aligned
+from ols import batch_ols
+from rolling import all_pairs, rolling_corr
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+BUNDLED = ['^DJI', '^GSPC', '^IXIC', '^NYA']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# rows of the longest bundled history; synthetic scales are multiples of it
+BASE_ROWS = 23_000
+# synthetic days start here and must keep four digit years to stay sortable as csv date strings
+# (about 130x the bundled history; the column store's second resolution dates go much further)
+SYNTHETIC_START = np.datetime64('1700-01-01')
+MAX_ROWS = int((np.datetime64('9999-12-31') - SYNTHETIC_START).astype(np.int64)) + 1
+
+# every pair is correlated up to this many tickers, beyond it each ticker is paired with the first one
+PAIR_LIMIT = 64
+
+# a result is a regression when it is over `ratio` x its baseline and also more than `floor` worse
+# (the floors keep timer and allocator noise on tiny stages from failing the run)
+TOLERANCE = {
+    'wall': {'ratio': 1.5, 'floor': 0.05},
+    'rss': {'ratio': 1.25, 'floor': 16 << 20},
+    'alloc': {'ratio': 1.25, 'floor': 8 << 20},
+}
+
+
+# =================== #
+# SYNTHETIC DATASETS  #
+# =================== #
+
+# write `tickers` synthetic OHLCV csvs of `rows` daily rows each in the Data/*.csv schema
+# log prices are a slowly mean reverting walk (~1.1% daily moves) so even the longest histories keep
+# index-like price levels, volume is log-normal; the same seed always gives the same files
+def synthetic(directory, tickers, rows, seed=0):
+    from scipy.signal import lfilter
+
+    if rows > MAX_ROWS:
+        raise ValueError(f'at most {MAX_ROWS} synthetic rows per ticker, asked for {rows}')
+    rng = np.random.default_rng(seed)
+    dates = np.datetime_as_string(SYNTHETIC_START + np.arange(rows), unit='D')
+    for ticker in tickers:
+        close = 100 * np.exp(lfilter([1], [1, -.9995], rng.normal(0, .011, rows)))
+        open_ = np.concatenate([[100], close[:-1]]) * np.exp(rng.normal(0, .002, rows))
+        spread = 1 + np.abs(rng.normal(0, .005, (2, rows)))
+        df = pd.DataFrame({
+            'Date': dates,
+            'Open': open_,
+            'High': np.maximum(open_, close) * spread[0],
+            'Low': np.minimum(open_, close) / spread[1],
+            'Close': close,
+            'Adj Close': close,
+            'Volume': rng.lognormal(15, 1, rows).astype(np.int64),
+        })
+        df.to_csv(loader.csv_path(ticker, directory), index=False, float_format='%.6f')
+
+
+def synthetic_names(count):
+    return [f'SYN{i:04d}' for i in range(count)]
+
+
+# ====== #
+# STAGES #
+# ====== #
+
+# each stage is (prepare, work): prepare(tickers) sets up and returns work's arguments and is not timed
+# stages run with the dataset directory as cwd, like the scripts themselves
+
+def no_cache(tickers):
+    shutil.rmtree(loader.CACHE_DIR, ignore_errors=True)
+    return tickers,
+
+
+def cached(tickers):
+    for ticker in tickers:
+        loader.refresh(ticker)
+    return tickers,
+
+
+def derived(tickers):
+    for ticker in tickers:
+        features.derive(ticker)
+    return tickers,
+
+
+def no_derived(tickers):
+    cached(tickers)
+    features._memo.clear()
+    for ticker in tickers:
+        shutil.rmtree(features.derived_path(ticker), ignore_errors=True)
+    return tickers,
+
+
+def changes(tickers):
+    derived(tickers)
+    n = len(tickers)
+    pairs = all_pairs(n) if n <= PAIR_LIMIT else [(0, j) for j in range(1, n)]
+    return Aligned(tickers, fields=['Pct Change']).column('Pct Change'), pairs
+
+
+def correlations(tickers):
+    block, pairs = changes(tickers)
+    rolling = rolling_corr(block, 25, pairs)
+    rolling = rolling[np.argmax(~np.isnan(rolling).any(axis=1)):]
+    return np.arange(len(rolling), dtype=np.float64), rolling
+
+
+# touches every stored column; dates are summed as their int64 seconds
+def read(tickers):
+    for ticker in tickers:
+        for values in loader.load_arrays(ticker).values():
+            values = np.asarray(values)
+            (values.view(np.int64) if values.dtype.kind == 'M' else values).sum()
+
+
+def derive(tickers):
+    for ticker in tickers:
+        features.derive(ticker)
+
+
+def align(tickers):
+    Aligned(tickers)
+
+
+def correlate(block, pairs):
+    rolling_corr(block, 25, pairs)
+
+
+def matrix(tickers):
+    from matrix import correlation_matrix
+    correlation_matrix(tickers)
+
+
+def graph(tickers):
+    from stock import Graph
+    g = Graph(tickers[0])
+    g.add_sma()
+    g.add_ema()
+    g.add_bb()
+    g.add_rollingvwap()
+    g.add_linregress()
+    g.fig.to_json()
+
+
+def correlate_pair(tickers):
+    from stock import Correlate
+    Correlate(tickers[0], tickers[1]).get_corr()
+
+
+def base(tickers):
+    from StatAnalys import Base
+    dataset = Base(*tickers)
+    dataset.summarize_change()
+    dataset.summarize_volume()
+    dataset.summarize_binomial()
+
+
+def research(tickers):
+    from PSET3 import Research
+    # the same batched fit as Research.reganal, without printing the table on every repeat
+    r = Research(*tickers)
+    batch_ols(np.arange(len(r.corr)), r.rolling, names=list(r.corr.columns))
+
+
+def prepare_render(tickers):
+    from stock import Graph
+    g = Graph(tickers[0])
+    g.add_sma()
+    g.add_bb()
+    # no manifest, so the image is really rendered every time
+    if os.path.exists('.bench_manifest.json'):
+        os.remove('.bench_manifest.json')
+    return g.fig,
+
+
+def render(fig):
+    from render import RenderQueue
+    with RenderQueue(workers=0, manifest='.bench_manifest.json') as queue:
+        queue.add(fig, 'bench.png')
+
+
+STAGES = {
+    'load': (no_cache, read),
+    'load (cached)': (cached, read),
+    'derive': (no_derived, derive),
+    'align': (derived, align),
+    'rolling corr': (changes, correlate),
+    'correlation matrix': (derived, matrix),
+    'regress': (correlations, batch_ols),
+    'render': (prepare_render, render),
+    'Graph': (derived, graph),
+    'Correlate': (derived, correlate_pair),
+    'Base': (derived, base),
+    'Research': (derived, research),
+}
+
+PIPELINE = ['load', 'load (cached)', 'derive', 'align', 'rolling corr', 'correlation matrix', 'regress']
+CLASSES = ['Graph', 'Correlate', 'Base', 'Research']
+
+
+# run one stage in this process: an untimed warm-up (imports, first-call setup), the best wall time of
+# `repeat` runs, then one traced run for the peak bytes allocated; peak rss is the whole process's
+# (imports, setup and all), which is why each stage gets a fresh process
+def measure(name, tickers, directory, repeat=3):
+    os.chdir(directory)
+    prepare, work = STAGES[name]
+    work(*prepare(tickers))
+    walls = []
+    for _ in range(repeat):
+        args = prepare(tickers)
+        start = time.perf_counter()
+        work(*args)
+        walls.append(time.perf_counter() - start)
+    args = prepare(tickers)
+    tracemalloc.start()
+    work(*args)
+    _, alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'wall': min(walls), 'rss': peak_rss(), 'alloc': alloc}
+
+
+# peak resident memory of this process in bytes
+# linux's VmHWM starts over at exec, unlike ru_maxrss which a spawned child inherits from its parent
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on linux but bytes on macos
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def isolated(name, tickers, directory, repeat):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(measure, name, tickers, directory, repeat).result()
+
+
+# ====== #
+# SUITES #
+# ====== #
+
+# (suite key, tickers, stages, function filling a directory with the csvs)
+# scales / rows beyond what synthetic() can write are rejected up front rather than measured short
+def suites(names, scales, counts, rows):
+    asked = ([scale * BASE_ROWS for scale in scales] if 'rows' in names else []) + \
+        ([rows] if 'tickers' in names else [])
+    if asked and max(asked) > MAX_ROWS:
+        raise ValueError(f'{max(asked)} rows per ticker asked for, synthetic histories stop at {MAX_ROWS} '
+                         f'(rows scale {MAX_ROWS // BASE_ROWS}x)')
+    if 'bundled' in names:
+        def bundled(directory):
+            for ticker in BUNDLED:
+                shutil.copy(loader.csv_path(ticker, DATA), directory)
+        yield 'bundled', BUNDLED, PIPELINE + ['render'] + CLASSES, bundled
+    if 'rows' in names:
+        for scale in scales:
+            tickers = synthetic_names(4)
+            yield f'rows {scale}x', tickers, PIPELINE + CLASSES, \
+                lambda directory, tickers=tickers, scale=scale: synthetic(directory, tickers, scale * BASE_ROWS)
+    if 'tickers' in names:
+        for count in counts:
+            tickers = synthetic_names(count)
+            yield f'tickers {count}', tickers, PIPELINE, \
+                lambda directory, tickers=tickers: synthetic(directory, tickers, rows)
+
+
+# (results, failures): measurements per 'suite/stage' and the error of every stage that raised
+def run(names=('bundled', 'rows', 'tickers'), scales=(1, 10), counts=(4, 16, 64, 256, 1000), rows=2500,
+        repeat=3, stages=None):
+    results = {}
+    failures = {}
+    for suite, tickers, suite_stages, fill in suites(names, scales, counts, rows):
+        directory = tempfile.mkdtemp(prefix='bench')
+        try:
+            fill(directory)
+            for name in suite_stages:
+                if stages is not None and name not in stages:
+                    continue
+                key = f'{suite}/{name}'
+                try:
+                    results[key] = isolated(name, tickers, directory, repeat)
+                except Exception as error:
+                    failures[key] = repr(error)
+                    print(f'{key} failed: {error!r}')
+                else:
+                    print(f'{key}: {results[key]}')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results, failures
+
+
+# results that got worse than the baseline by more than TOLERANCE (stages without a baseline are left to main)
+def regressions(results, baseline):
+    found = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+        for metric, limit in TOLERANCE.items():
+            old, new = baseline[key][metric], metrics[metric]
+            if new > old * limit['ratio'] and new - old > limit['floor']:
+                found.append((key, metric, old, new))
+    return found
+
+
+def report(results, baseline):
+    rows = []
+    for key, metrics in results.items():
+        old = baseline.get(key, {})
+        rows.append({
+            'Stage': key,
+            'Wall (s)': round(metrics['wall'], 4),
+            'Peak RSS (MiB)': round(metrics['rss'] / 2 ** 20, 1),
+            'Peak alloc (MiB)': round(metrics['alloc'] / 2 ** 20, 1),
+            'Wall vs baseline': round(metrics['wall'] / old['wall'], 2) if old else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+# =================== #
+# COMPACT DATA REPORT #
+# =================== #
+
+# bytes still held after building `make()` (numpy and pandas allocations; mmapped column stores are free)
+def retained(make):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    value = make()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, after - before
+
+
+# memory Base and Research hold with and without compact=True, and how far the compact correlation outputs
+# move: rolling pair correlations (Research.corr), the full-sample correlation matrix (Base.correlation)
+# and the pct change summary; run with the csvs in the cwd
+def compact_report(tickers=BUNDLED, window=25):
+    from PSET3 import Research
+    from StatAnalys import Base
+
+    for ticker in tickers:
+        features.derive(ticker)
+        features.derive(ticker, dtype=np.float32)
+    base, base_bytes = retained(lambda: Base(*tickers))
+    small_base, small_base_bytes = retained(lambda: Base(*tickers, compact=True))
+    research, research_bytes = retained(lambda: Research(*tickers, window=window))
+    small_research, small_research_bytes = retained(lambda: Research(*tickers, window=window, compact=True))
+
+    columns = list(small_base.combined.columns[1:])
+    matrix = base.combined[columns].corr().to_numpy()
+    small_matrix = small_base.combined[columns].corr().to_numpy()
+    change = base.summarize_change().set_index('Name')
+    small_change = small_base.summarize_change().set_index('Name')
+    rows = [
+        {'Measure': 'Base memory (MiB)', 'Default': base_bytes / 2 ** 20, 'Compact': small_base_bytes / 2 ** 20},
+        {'Measure': 'Research memory (MiB)', 'Default': research_bytes / 2 ** 20,
+         'Compact': small_research_bytes / 2 ** 20},
+        {'Measure': 'Max abs error, rolling corr', 'Default': 0.0,
+         'Compact': np.nanmax(np.abs(research.rolling - small_research.rolling.astype(np.float64)))},
+        {'Measure': 'Max abs error, correlation matrix', 'Default': 0.0,
+         'Compact': np.nanmax(np.abs(matrix - small_matrix))},
+        {'Measure': 'Max abs error, pct change summary', 'Default': 0.0,
+         'Compact': np.nanmax(np.abs(change.to_numpy() - small_change.to_numpy()))},
+    ]
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time and measure the load -> derive -> correlate -> regress -> '
+                                                 'render pipeline and the analysis classes')
+    parser.add_argument('--suite', nargs='+', default=['bundled', 'rows', 'tickers'],
+                        choices=['bundled', 'rows', 'tickers'])
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10], help='synthetic rows, x bundled history')
+    parser.add_argument('--tickers', nargs='+', type=int, default=[4, 16, 64, 256, 1000])
+    parser.add_argument('--rows', type=int, default=2500, help='rows per ticker in the tickers suite')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help='only these stages')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--output', help='also write the results to this json file')
+    parser.add_argument('--compact-report', action='store_true',
+                        help='only compare memory and correlation precision of compact=True on the bundled data')
+    args = parser.parse_args()
+
+    if args.compact_report:
+        directory = tempfile.mkdtemp(prefix='bench')
+        try:
+            for ticker in BUNDLED:
+                shutil.copy(loader.csv_path(ticker, DATA), directory)
+            os.chdir(directory)
+            print(compact_report().to_string(index=False))
+        finally:
+            os.chdir(os.path.dirname(os.path.abspath(__file__)))
+            shutil.rmtree(directory, ignore_errors=True)
+        return 0
+
+    try:
+        results, failures = run(args.suite, args.scales, args.tickers, args.rows, args.repeat, args.stages)
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    print(report(results, baseline).to_string(index=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    # a stage that crashed fails the run, and is never written into a baseline
+    for key, error in failures.items():
+        print(f'FAILED {key}: {error}')
+    if args.save:
+        if failures:
+            print('baseline not saved: fix the failed stages first')
+            return 1
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return 0
+
+    found = regressions(results, baseline)
+    for key, metric, old, new in found:
+        print(f'REGRESSION {key} {metric}: {old:.4g} -> {new:.4g}')
+    # a stage without a baseline is not guarded, so it fails the run until it is recorded with --save
+    missing = [key for key in results if key not in baseline]
+    for key in missing:
+        print(f'NO BASELINE {key} (record it with --save)')
+    return 1 if found or missing or failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
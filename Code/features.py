@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import loader
+
+DERIVED = ('Avg Price', 'Pct Change', 'Up Day', 'Same Direction')
+
+# derived columns of the most recently used tickers
+_memo = loader.Memo(256)
+
+
+# avg price, pct change, if traded up (1,0), if traded in same direction as previous session (1,0)
+# pct change is taken in float64 and only then narrowed, so the float32 option loses no extra precision
+def compute(high, low, close, dtype=np.float64):
+    n = len(close)
+    avg = np.add(high, low, dtype=np.float64)
+    avg += close
+    avg /= 3
+    pct = np.empty(n, np.float64)
+    pct[:1] = np.nan
+    np.divide(avg[1:], avg[:-1], out=pct[1:])
+    pct[1:] -= 1
+    up = np.greater(pct, 0).view(np.int8)
+    same = np.zeros(n, np.int8)
+    np.equal(up[1:], up[:-1], out=same[1:].view(bool))
+    return {'Avg Price': avg.astype(dtype, copy=False), 'Pct Change': pct.astype(dtype, copy=False),
+            'Up Day': up, 'Same Direction': same}
+
+
+def derived_path(ticker, directory='.', dtype=np.float64):
+    return os.path.join(loader.cache_path(ticker, directory), f'derived_{np.dtype(dtype).name}')
+
+
+# derived columns for a ticker, memoized per (ticker, source version, dtype) for the most recent tickers
+# results are also persisted beside the column store so other scripts/processes reuse them
+# version picks the source version to derive from (default the current one)
+def derive(ticker, directory='.', dtype=np.float64, version=None):
+    version = loader.version(ticker, directory) if version is None else version
+    key = (os.path.abspath(directory), ticker, np.dtype(dtype).name)
+    cached = _memo.get(key, version)
+    if cached is not None:
+        return cached
+
+    # each source version is its own directory (see loader.publish), so concurrent workers never collide
+    # the columns are small and read whole, so they are not mapped (a mapping holds a file descriptor open)
+    target = derived_path(ticker, directory, dtype)
+    try:
+        columns = {column: np.load(os.path.join(target, version, f'{column}.npy')) for column in DERIVED}
+    except FileNotFoundError:
+        source = loader.load_arrays(ticker, directory, ['High', 'Low', 'Close'], version)
+        columns = compute(source['High'], source['Low'], source['Close'], dtype)
+
+        def write(path):
+            for column, values in columns.items():
+                np.save(os.path.join(path, f'{column}.npy'), values)
+        loader.publish(target, version, write)
+
+    _memo.put(key, version, columns)
+    return columns
+
+
+# loaded columns plus derived columns as one frame
+def frame(ticker, directory='.', columns=None, dtype=np.float64):
+    def read(version):
+        data = loader.load_arrays(ticker, directory, columns, version)
+        data.update(derive(ticker, directory, dtype, version))
+        return pd.DataFrame(data, copy=False)
+    return loader.current(ticker, directory, read)
@@ -0,0 +1,231 @@
+import hashlib
+import io
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import loader
+from align import common_days, day_keys, label, pair_label
+from profiler import count
+from rolling import RollingCorr, RollingSums, all_pairs
+
+
+# rows appended to a csv after byte `offset`, and the new end offset
+# offset 0 reads the header as usual; null placeholder rows are dropped like in the column store
+def read_new_rows(path, offset=0):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = offset + len(data)
+    count('bytes read', len(data))
+    if not data.strip():
+        return pd.DataFrame(columns=list(loader.COLUMNS)), end
+    header = 0 if offset == 0 else None
+    df = pd.read_csv(io.BytesIO(data), header=header, names=list(loader.COLUMNS), na_values=['null'])
+    df = df.dropna()
+    df['Date'] = loader.parse_dates(df['Date'])
+    df['Volume'] = df['Volume'].astype(np.int64)
+    return df.reset_index(drop=True), end
+
+
+# fingerprint of the bytes just before `offset`, used to notice a csv that was rewritten instead of appended to
+def signature(path, offset, size=256):
+    with open(path, 'rb') as f:
+        f.seek(max(offset - size, 0))
+        return hashlib.sha1(f.read(min(size, offset))).hexdigest()
+
+
+class Indicators:
+
+    # carried state for Graph's indicators and Base's derived columns over avg price and volume
+    # sma and bb of the same period share one set of window sums; every update costs O(new rows)
+    def __init__(self, sma=(20,), ema=(20,), bb=((20, 2),), vwap=(10,)):
+        self.sma = tuple(sma)
+        self.ema = {period: None for period in ema}
+        self.bb = tuple(bb)
+        self.price = {period: RollingSums(period, 2) for period in set(self.sma) | {p for p, _ in self.bb}}
+        self.vwap = {period: RollingSums(period, 2) for period in vwap}
+        # avg price and up day of the last row seen, for pct change and same direction
+        self.last_avg = np.nan
+        self.last_up = None
+        self.shift = None
+
+    # continue pct change / up day / same direction from earlier rows' avg prices (the last two are enough)
+    def seed(self, avg):
+        if len(avg):
+            self.last_avg = avg[-1]
+            self.last_up = int(len(avg) > 1 and avg[-1] / avg[-2] - 1 > 0)
+
+    def outputs(self):
+        names = ['Avg Price', 'Pct Change', 'Up Day', 'Same Direction']
+        names += [f'SMA{period}' for period in self.sma]
+        for period, deviations in self.bb:
+            names += [f'BB Upper{period}x{deviations}', f'BB Lower{period}x{deviations}']
+        names += [f'EMA{period}' for period in self.ema]
+        return names + [f'Rolling VWAP{period}' for period in self.vwap]
+
+    def update(self, high, low, close, volume):
+        avg = (np.asarray(high, dtype=np.float64) + low + close) / 3
+        volume = np.asarray(volume, dtype=np.float64)
+        if not len(avg):
+            return {name: np.empty(0) for name in self.outputs()}
+        out = {'Avg Price': avg}
+
+        pct = np.empty(len(avg))
+        pct[0] = avg[0] / self.last_avg - 1
+        pct[1:] = avg[1:] / avg[:-1] - 1
+        up = (pct > 0).astype(np.int8)
+        previous = np.concatenate([[-1 if self.last_up is None else self.last_up], up[:-1]])
+        out['Pct Change'], out['Up Day'], out['Same Direction'] = pct, up, (up == previous).astype(np.int8)
+        self.last_avg, self.last_up = avg[-1], up[-1]
+
+        # sums of the price are taken about the first price seen so the variance does not cancel
+        if self.shift is None:
+            self.shift = avg[0]
+        centred = avg - self.shift
+        moments = {}
+        for period, sums in self.price.items():
+            totals, counts = sums.update(np.column_stack([centred, centred * centred]))
+            n = counts[:, 0].astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = totals[:, 0] / n
+                std = np.sqrt((totals[:, 1] - totals[:, 0] * mean) / (n - 1))
+            full = n >= period
+            moments[period] = np.where(full, mean + self.shift, np.nan), np.where(full, std, np.nan)
+        for period in self.sma:
+            out[f'SMA{period}'] = moments[period][0]
+        for period, deviations in self.bb:
+            mean, std = moments[period]
+            out[f'BB Upper{period}x{deviations}'] = mean + deviations * std
+            out[f'BB Lower{period}x{deviations}'] = mean - deviations * std
+
+        # ewm(span=period, adjust=False): e[t] = a * x[t] + (1 - a) * e[t - 1], starting from the first price
+        # (scipy.signal is slow to import, so only runs that ask for an EMA load it)
+        if self.ema:
+            from scipy.signal import lfilter
+        for period, carry in self.ema.items():
+            alpha = 2 / (period + 1)
+            carry = avg[0] if carry is None else carry
+            values, _ = lfilter([alpha], [1, alpha - 1], avg, zi=[(1 - alpha) * carry])
+            out[f'EMA{period}'] = values
+            self.ema[period] = values[-1]
+
+        for period, sums in self.vwap.items():
+            totals, counts = sums.update(np.column_stack([avg * volume, volume]))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vwap = totals[:, 0] / totals[:, 1]
+            out[f'Rolling VWAP{period}'] = np.where(counts[:, 0] >= period, vwap, np.nan)
+        return out
+
+
+class Tracker:
+
+    # incremental indicators for one ticker: each refresh parses only the rows appended to the csv since the
+    # last one and advances the carried state; a rewritten (not appended) csv starts over from the top
+    def __init__(self, ticker, directory='.', **indicators):
+        self.ticker = ticker
+        self.directory = directory
+        self.settings = indicators
+        self.reset()
+
+    def reset(self):
+        self.indicators = Indicators(**self.settings)
+        self.offset = 0
+        self.signature = None
+        self.last_day = None
+
+    # read and apply new rows; returns a frame of every output for just those rows
+    def refresh(self):
+        path = loader.csv_path(self.ticker, self.directory)
+        if os.path.getsize(path) < self.offset or signature(path, self.offset) != self.signature:
+            self.reset()
+        rows, self.offset = read_new_rows(path, self.offset)
+        self.signature = signature(path, self.offset)
+        if self.last_day is not None:
+            rows = rows[day_keys(rows['Date'].to_numpy()) > self.last_day].reset_index(drop=True)
+        if len(rows):
+            self.last_day = day_keys(rows['Date'].to_numpy())[-1]
+        out = self.indicators.update(rows['High'].to_numpy(), rows['Low'].to_numpy(), rows['Close'].to_numpy(),
+                                     rows['Volume'].to_numpy())
+        return pd.DataFrame({'Date': rows['Date'], 'Volume': rows['Volume'], **out})
+
+    def state_path(self):
+        return os.path.join(loader.cache_path(self.ticker, self.directory), 'incremental.pkl')
+
+    def save(self, path=None):
+        path = self.state_path() if path is None else path
+        loader.replace_file(path, lambda f: pickle.dump(self, f))
+
+    # the saved tracker if there is one with the same settings, else a fresh one
+    @classmethod
+    def load(cls, ticker, directory='.', **indicators):
+        fresh = cls(ticker, directory, **indicators)
+        try:
+            with open(fresh.state_path(), 'rb') as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return fresh
+        return saved if saved.settings == fresh.settings else fresh
+
+
+class CorrTracker:
+
+    # incremental rolling correlation of pct change between tickers, like Research(window=...)
+    # rows are pushed once every ticker has printed that day; days one ticker is still missing wait in `pending`
+    def __init__(self, tickers, window=25, directory='.'):
+        self.tickers = list(tickers)
+        self.window = window
+        self.directory = directory
+        self.trackers = [Tracker(ticker, directory, sma=(), ema=(), bb=(), vwap=()) for ticker in self.tickers]
+        self.pairs = all_pairs(len(self.tickers))
+        self.corr = RollingCorr(window, self.pairs)
+        self.pending = [pd.DataFrame(columns=['Date', 'Pct Change']) for _ in self.tickers]
+
+    def refresh(self):
+        for i, tracker in enumerate(self.trackers):
+            if tracker.offset and signature(loader.csv_path(tracker.ticker, self.directory), tracker.offset) \
+                    != tracker.signature:
+                # a rewritten csv invalidates the whole correlation history
+                self.__init__(self.tickers, self.window, self.directory)
+                return self.refresh()
+            rows = tracker.refresh()[['Date', 'Pct Change']]
+            self.pending[i] = pd.concat([self.pending[i], rows], ignore_index=True) if len(self.pending[i]) else rows
+
+        keys = [day_keys(rows['Date'].to_numpy()) for rows in self.pending]
+        days = common_days(keys, self.tickers)
+        block = np.column_stack([rows['Pct Change'].to_numpy(np.float64)[np.searchsorted(key, days)]
+                                 for rows, key in zip(self.pending, keys)]) if len(days) else \
+            np.empty((0, len(self.tickers)))
+        if len(days):
+            self.pending = [rows[key > days[-1]].reset_index(drop=True) for rows, key in zip(self.pending, keys)]
+        values = self.corr.update(block) if len(days) else np.empty((0, len(self.pairs)))
+        columns = [pair_label(self.tickers[i], self.tickers[j]) for i, j in self.pairs]
+        index = pd.Index(days.astype('datetime64[D]').astype(loader.COLUMNS['Date']), name='Date')
+        return pd.DataFrame(values, index=index, columns=columns)
+
+    def state_path(self):
+        name = '_'.join(label(ticker) for ticker in self.tickers)
+        return os.path.join(self.directory, loader.CACHE_DIR, f'corr_{name}_{self.window}.pkl')
+
+    def save(self, path=None):
+        path = self.state_path() if path is None else path
+        loader.replace_file(path, lambda f: pickle.dump(self, f))
+
+    @classmethod
+    def load(cls, tickers, window=25, directory='.'):
+        fresh = cls(tickers, window, directory)
+        try:
+            with open(fresh.state_path(), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return fresh
+
+
+# bring a ticker's indicators up to date and persist the state; returns only the new rows
+def refresh(ticker, directory='.', **indicators):
+    tracker = Tracker.load(ticker, directory, **indicators)
+    rows = tracker.refresh()
+    tracker.save()
+    return rows
@@ -0,0 +1,63 @@
+import numpy as np
+
+from incremental import Indicators
+from ols import Moments
+from profiler import count, stage
+
+COLORS = {'sma': '#000000', 'ema': '#6a0dad', 'bb': '#7fe5f0', 'vwap': '#ef4135', 'linregress': '#ffa500'}
+
+
+class Pipeline:
+
+    # indicators declared on one price history and only computed when first asked for
+    # repeated declarations collapse into one step, and every step is evaluated in a single fused pass
+    # (Indicators shares the window sums of an SMA and a BB of the same period)
+    def __init__(self):
+        self.steps = []
+        self.values = None
+        self.trend = None
+
+    def add(self, kind, *params):
+        step = (kind,) + params
+        if step not in self.steps:
+            self.steps.append(step)
+            self.values = None
+
+    # output columns of one step, in plotting order
+    # bollinger bands are keyed by period and deviations, so bands of one period with different widths differ
+    @staticmethod
+    def outputs(step):
+        kind, params = step[0], step[1:]
+        if kind == 'sma':
+            return [f'SMA{params[0]}']
+        if kind == 'ema':
+            return [f'EMA{params[0]}']
+        if kind == 'bb':
+            return [f'BB Upper{params[0]}x{params[1]}', f'BB Lower{params[0]}x{params[1]}']
+        if kind == 'vwap':
+            return [f'Rolling VWAP{params[0]}']
+        return ['Linear Regression']
+
+    # legend name of an output column (bands are shown by period only)
+    def label(self, step, name):
+        if step[0] == 'bb':
+            return name[:name.rindex('x')]
+        if step[0] == 'linregress':
+            return f'Linear Regression (y={round(self.trend.slope, 4)}x + {round(self.trend.intercept, 2)})'
+        return name
+
+    def evaluate(self, high, low, close, volume, index):
+        if self.values is None:
+            count('indicator rows', len(close) * len(self.steps))
+            with stage('Graph.indicators', steps=len(self.steps), rows=len(close)):
+                self.values = self.compute(high, low, close, volume, index)
+        return self.values
+
+    def compute(self, high, low, close, volume, index):
+        settings = {kind: tuple(step[1] if kind != 'bb' else step[1:] for step in self.steps if step[0] == kind)
+                    for kind in ('sma', 'ema', 'bb', 'vwap')}
+        values = Indicators(**settings).update(high, low, close, volume)
+        if ('linregress',) in self.steps:
+            self.trend = Moments(index, values['Avg Price'])
+            values['Linear Regression'] = self.trend.line(np.asarray(index, dtype=np.float64))
+        return values
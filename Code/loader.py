@@ -0,0 +1,210 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from profiler import count, stage
+
+# typed layout of the columnar store, in csv column order
+# dates are kept to the second rather than pandas' default nanosecond, whose range ends in 2262
+COLUMNS = {
+    'Date': 'datetime64[s]',
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Adj Close': 'float64',
+    'Volume': 'int64',
+}
+CACHE_DIR = '__colcache__'
+
+
+# the last `size` results per key, each kept with the source version it was built from
+# bounded so a run over hundreds of tickers does not keep every ticker's arrays (and any file they map) alive
+class Memo:
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # the value stored for key if it was built from `version`, else None
+    def get(self, key, version):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None or cached[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return cached[1]
+
+    def put(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# iso date strings as the stored Date dtype (numpy parses them, so there is no nanosecond range to hit)
+def parse_dates(values):
+    return np.asarray(values, dtype=str).astype(COLUMNS['Date'])
+
+
+def csv_path(ticker, directory='.'):
+    return os.path.join(directory, f'{ticker}.csv')
+
+
+def cache_path(ticker, directory='.'):
+    return os.path.join(directory, CACHE_DIR, ticker)
+
+
+# one directory per built version of the columns (named by the csv's sha1), chosen through meta.json
+def store_path(ticker, directory='.'):
+    return os.path.join(cache_path(ticker, directory), 'columns')
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_meta(ticker, directory='.'):
+    try:
+        with open(os.path.join(cache_path(ticker, directory), 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(ticker, meta, directory='.'):
+    replace_file(os.path.join(cache_path(ticker, directory), 'meta.json'), lambda f: json.dump(meta, f), 'w')
+
+
+# write a file through a temp file of its own and rename it into place, so concurrent writers never share
+# a temp file and readers only ever see a whole file (the last rename wins)
+def replace_file(path, write, mode='wb'):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, mode) as f:
+            write(f)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+# make target/version the complete output of `write(path)`: it fills a private temp directory that is then
+# renamed into place in one step, so a version directory is never seen half written
+# a concurrent build of the same version that got there first wins (same content) and this one is dropped;
+# all but the newest `keep` versions are pruned, and a reader that loses its version to the pruning just
+# loads the current one again (see current)
+def publish(target, version, write, keep=2):
+    final = os.path.join(target, version)
+    os.makedirs(target, exist_ok=True)
+    temp = tempfile.mkdtemp(dir=target, prefix='.build')
+    try:
+        write(temp)
+        os.rename(temp, final)
+    except BaseException as error:
+        shutil.rmtree(temp, ignore_errors=True)
+        if not (isinstance(error, OSError) and os.path.isdir(final)):
+            raise
+    versions = []
+    for name in os.listdir(target):
+        try:
+            versions.append((os.stat(os.path.join(target, name)).st_mtime_ns, name))
+        except OSError:
+            pass
+    versions = sorted((entry for entry in versions if not entry[1].startswith('.')), reverse=True)
+    for _, name in versions[keep:]:
+        if name != version:
+            shutil.rmtree(os.path.join(target, name), ignore_errors=True)
+    return final
+
+
+# parse the csv once and write one .npy file per column, into a new version directory
+# rows yahoo marks as null (non-trading placeholders) are dropped so Volume can stay int64
+# the bytes are read once, so the hash is always that of the rows parsed even if the csv is being appended to
+def build(ticker, directory='.'):
+    source = csv_path(ticker, directory)
+    stat = os.stat(source)
+    with open(source, 'rb') as f:
+        data = f.read()
+    with stage('parse csv', ticker=ticker):
+        df = pd.read_csv(io.BytesIO(data), na_values=['null']).dropna()
+    count('bytes read', len(data))
+    count('csv rows parsed', len(df))
+
+    def write(path):
+        for column, dtype in COLUMNS.items():
+            values = parse_dates(df[column]) if column == 'Date' else df[column].to_numpy(dtype=dtype)
+            np.save(os.path.join(path, f'{column}.npy'), np.ascontiguousarray(values))
+
+    meta = {'mtime': stat.st_mtime_ns, 'size': len(data), 'sha1': hashlib.sha1(data).hexdigest(), 'rows': len(df)}
+    publish(store_path(ticker, directory), meta['sha1'], write)
+    # meta is switched last so a half-built store is never treated as valid
+    write_meta(ticker, meta, directory)
+    return meta
+
+
+# return the store metadata, rebuilding only if the csv changed since the last build
+# mtime/size are checked first; the hash only runs when those differ (e.g. after a touch or copy)
+def refresh(ticker, directory='.'):
+    stat = os.stat(csv_path(ticker, directory))
+    meta = read_meta(ticker, directory)
+    if meta is not None and not os.path.isdir(os.path.join(store_path(ticker, directory), meta['sha1'])):
+        meta = None
+    if meta is not None and meta['mtime'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return meta
+    if meta is not None and meta['size'] == stat.st_size and meta['sha1'] == file_hash(csv_path(ticker, directory)):
+        meta['mtime'] = stat.st_mtime_ns
+        write_meta(ticker, meta, directory)
+        return meta
+    return build(ticker, directory)
+
+
+# version string for a ticker's data; changes whenever the source csv content changes
+def version(ticker, directory='.'):
+    return refresh(ticker, directory)['sha1']
+
+
+# read(version) with the ticker's current version, tried again if a concurrent rebuild (after a csv change)
+# pruned that version part way through, so everything read comes from one version
+def current(ticker, directory, read, attempts=3):
+    for attempt in range(attempts):
+        try:
+            return read(version(ticker, directory))
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+
+
+# memory-mapped column arrays for a ticker, all from the same version (the current one unless given)
+def load_arrays(ticker, directory='.', columns=None, version=None):
+    if version is None:
+        return current(ticker, directory, lambda version: load_arrays(ticker, directory, columns, version))
+    target = os.path.join(store_path(ticker, directory), version)
+    columns = COLUMNS if columns is None else columns
+    return {column: np.load(os.path.join(target, f'{column}.npy'), mmap_mode='r') for column in columns}
+
+
+# drop-in replacement for pd.read_csv(f'{ticker}.csv')
+def load(ticker, directory='.', columns=None):
+    return pd.DataFrame(load_arrays(ticker, directory, columns), copy=False)
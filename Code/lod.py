@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+
+import loader
+
+# most candles / line points one trace is drawn with
+POINTS = 2000
+CANDLE = ('Date', 'Index', 'Open', 'High', 'Low', 'Close', 'Volume')
+# coarser levels of the pyramid, finest first
+RULES = ('W', 'M')
+
+# pyramids of the most recently charted tickers; each daily level maps the column store's files
+_memo = loader.Memo(16)
+
+
+# bucket of every date: monday-start weeks or calendar months
+def bucket_keys(dates, rule):
+    days = np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+    if rule == 'W':
+        # 1970-01-01 was a thursday, so shifting by 3 days makes the weeks start on monday
+        return (days + 3) // 7
+    return np.asarray(dates).astype('datetime64[M]').astype(np.int64)
+
+
+# ohlc candles of one coarser level: first open, highest high, lowest low, last close, total volume
+# Date and Index are those of each bucket's first row, so the candles sit on the same x axis as the daily ones
+def resample(columns, rule):
+    keys = bucket_keys(columns['Date'], rule)
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.empty(0, np.int64)
+    ends = np.append(starts[1:], len(keys)) - 1
+    if not len(starts):
+        return {column: np.asarray(columns[column])[:0] for column in CANDLE}
+    return {
+        'Date': np.asarray(columns['Date'])[starts],
+        'Index': np.asarray(columns['Index'])[starts],
+        'Open': np.asarray(columns['Open'])[starts],
+        'High': np.maximum.reduceat(columns['High'], starts),
+        'Low': np.minimum.reduceat(columns['Low'], starts),
+        'Close': np.asarray(columns['Close'])[ends],
+        'Volume': np.add.reduceat(columns['Volume'], starts),
+    }
+
+
+# daily candles plus every coarser level, from columns or a frame holding CANDLE
+def build(columns):
+    levels = {'D': {column: np.asarray(columns[column]) for column in CANDLE}}
+    for rule in RULES:
+        levels[rule] = resample(levels['D'], rule)
+    return levels
+
+
+def pyramid_path(ticker, directory='.'):
+    return os.path.join(loader.cache_path(ticker, directory), 'lod')
+
+
+# the whole history's pyramid, memoized per source version and persisted beside the column store
+# (same invalidation as features.derive); the daily level is the mmapped column store itself
+def pyramid(ticker, directory='.'):
+    return loader.current(ticker, directory, lambda version: _pyramid(ticker, directory, version))
+
+
+def _pyramid(ticker, directory, version):
+    key = (os.path.abspath(directory), ticker)
+    cached = _memo.get(key, version)
+    if cached is not None:
+        return cached
+
+    daily = loader.load_arrays(ticker, directory, ['Date', 'Open', 'High', 'Low', 'Close', 'Volume'], version)
+    daily['Index'] = np.arange(len(daily['Date']))
+    levels = {'D': {column: daily[column] for column in CANDLE}}
+
+    # one directory per source version, published whole (see loader.publish)
+    # the coarser levels are small, so they are read whole rather than mapped (each mapping holds a descriptor)
+    target = pyramid_path(ticker, directory)
+    try:
+        for rule in RULES:
+            levels[rule] = {column: np.load(os.path.join(target, version, f'{rule}_{column}.npy'))
+                            for column in CANDLE}
+    except FileNotFoundError:
+        for rule in RULES:
+            levels[rule] = resample(levels['D'], rule)
+
+        def write(path):
+            for rule in RULES:
+                for column, values in levels[rule].items():
+                    np.save(os.path.join(path, f'{rule}_{column}.npy'), values)
+        loader.publish(target, version, write)
+
+    _memo.put(key, version, levels)
+    return levels
+
+
+# candles covering daily rows [first, last) at the finest level that fits in `points` (None = always daily)
+# monthly is the coarsest level, so a very long range can still go over
+# buckets cut by first / last are rebuilt from just their daily rows in the range, the rest are the stored ones
+def candles(levels, first, last, points=POINTS):
+    daily = levels['D']
+    if points is None or last - first <= points:
+        return {column: values[first:last] for column, values in daily.items()}
+    for rule in RULES:
+        level = levels[rule]
+        starts = np.asarray(level['Index'])
+        # buckets overlapping the range: the one holding `first` through the last one starting before `last`
+        lo, hi = max(np.searchsorted(starts, first, 'right') - 1, 0), np.searchsorted(starts, last)
+        if hi - lo <= points or rule == RULES[-1]:
+            break
+
+    # whole buckets start on or after `first` and end (the next bucket's start) on or before `last`
+    ends = np.append(starts[1:], len(daily['Index']))
+    whole_lo, whole_hi = np.searchsorted(starts, first), np.searchsorted(ends, last, 'right')
+    if whole_lo >= whole_hi:
+        return resample({column: values[first:last] for column, values in daily.items()}, rule)
+    head = resample({column: values[first:starts[whole_lo]] for column, values in daily.items()}, rule)
+    tail = resample({column: values[ends[whole_hi - 1]:last] for column, values in daily.items()}, rule)
+    return {column: np.concatenate([head[column], level[column][whole_lo:whole_hi], tail[column]])
+            for column in CANDLE}
+
+
+# largest-triangle-three-buckets: indexes of `points` samples that keep the visual shape of the line
+# the first and last points are always kept; every bucket in between keeps the point forming the largest
+# triangle with the previously kept point and the average of the next bucket
+def lttb(x, y, points=POINTS):
+    n = len(y)
+    if points is None or n <= points or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        following = slice(hi, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[a] - mean_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+# positions of y to draw with at most `points` samples; missing values are left out before decimating
+def decimate(y, x=None, points=POINTS):
+    y = np.asarray(y, dtype=np.float64)
+    if points is None or len(y) <= points:
+        return np.arange(len(y))
+    present = np.flatnonzero(~np.isnan(y))
+    x = present if x is None else np.asarray(x)[present]
+    return present[lttb(x, y[present], points)]
@@ -0,0 +1,114 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import features
+import loader
+from align import day_keys
+from ols import Moments, comoments
+from render import queued
+
+# worker-side view of the shared arrays, set once per process by attach()
+_shared = {}
+
+
+# pct change (or another stored / derived field) of every ticker on the union of their trading days
+# (NaN where a ticker did not trade), each csv loaded once
+def union_block(tickers, directory='.', period=None, field='Pct Change'):
+    keys, changes = [], []
+    for ticker in tickers:
+        dates, change = loader.current(ticker, directory, lambda version: _field(ticker, directory, field, version))
+        if period is not None:
+            dates, change = dates[-period:], change[-period:]
+        keys.append(day_keys(dates))
+        changes.append(change)
+    days = np.unique(np.concatenate(keys))
+    block = np.full((len(days), len(tickers)), np.nan)
+    for j, (key, change) in enumerate(zip(keys, changes)):
+        block[np.searchsorted(days, key), j] = change
+    return days, block
+
+
+# dates and one field of a ticker, both from the same version of its csv
+def _field(ticker, directory, field, version):
+    dates = loader.load_arrays(ticker, directory, ['Date'], version)['Date']
+    if field in features.DERIVED:
+        return dates, features.derive(ticker, directory, version=version)[field]
+    return dates, loader.load_arrays(ticker, directory, [field], version)[field]
+
+
+def attach(name, shape):
+    memory = shared_memory.SharedMemory(name=name)
+    _shared['memory'] = memory
+    _shared['values'], _shared['mask'], _shared['squares'] = np.ndarray(shape, np.float64, buffer=memory.buf)
+
+
+# pair sums for columns start:stop against every column, over the rows where both are present
+# with values zeroed where missing and mask = 1 where present, each sum is one matrix product
+def pair_stats(start, stop):
+    values, mask, squares = _shared['values'], _shared['mask'], _shared['squares']
+    x, m, xx = values[:, start:stop], mask[:, start:stop], squares[:, start:stop]
+    n = m.T @ mask
+    sx, sy = x.T @ mask, m.T @ values
+    sxx, syy, sxy = xx.T @ mask, m.T @ squares, x.T @ values
+    _, _, _, corr, slope = comoments(sx, sy, sxx, syy, sxy, n)
+    # regression of column j on row i: y = slope * x + intercept, in the centred units
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intercept = (sy - slope * sx) / n
+    return start, n, corr, slope, intercept
+
+
+# correlation/regression of daily pct change between every pair of tickers
+# the pct change block (with its mask and squares) is put in shared memory once and workers each take a
+# band of rows of the matrix, so no worker holds a private copy of anything days x tickers;
+# returns frames 'corr', 'slope', 'intercept' and 'n' (rows = x ticker, columns = y ticker)
+# plots=True also renders each pair's scatter like Correlate.get_scatplot, through the render queue
+def correlation_matrix(tickers, directory='.', workers=None, band=64, period=None, plots=False, queue=None):
+    tickers = list(tickers)
+    days, block = union_block(tickers, directory, period)
+    present = ~np.isnan(block)
+    # centred on the column means (see ols.comoments); slopes and correlations do not change
+    means = np.nanmean(block, axis=0)
+    shape = (3,) + block.shape
+    memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        shared = np.ndarray(shape, np.float64, buffer=memory.buf)
+        shared[0] = np.where(present, block - means, 0.0)
+        shared[1] = present
+        np.multiply(shared[0], shared[0], out=shared[2])
+        count = len(tickers)
+        results = {name: np.empty((count, count)) for name in ('n', 'corr', 'slope', 'intercept')}
+        bands = [(start, min(start + band, count)) for start in range(0, count, band)]
+
+        if workers == 0 or len(bands) == 1:
+            attach(memory.name, shape)
+            outputs = [pair_stats(start, stop) for start, stop in bands]
+            _shared.clear()
+        else:
+            with ProcessPoolExecutor(workers, initializer=attach, initargs=(memory.name, shape)) as pool:
+                outputs = list(pool.map(pair_stats, *zip(*bands)))
+        for start, n, corr, slope, intercept in outputs:
+            stop = start + len(n)
+            results['n'][start:stop] = n
+            results['corr'][start:stop] = corr
+            results['slope'][start:stop] = slope
+            # back to raw units: y - my = slope * (x - mx) + c
+            results['intercept'][start:stop] = intercept + means[None, :] - slope * means[start:stop, None]
+    finally:
+        memory.close()
+        memory.unlink()
+
+    frames = {name: pd.DataFrame(values, index=tickers, columns=tickers) for name, values in results.items()}
+    frames['n'] = frames['n'].astype(np.int64)
+    if plots:
+        from stock import scatter_plot
+        with queued(queue) as queue:
+            for i, ticker1 in enumerate(tickers):
+                for j, ticker2 in enumerate(tickers):
+                    both = present[:, i] & present[:, j]
+                    x, y = block[both, i], block[both, j]
+                    fig = scatter_plot(x, y, ticker1, ticker2, Moments(x, y))
+                    queue.add(fig, f'{ticker1}_{ticker2}_corr.png')
+    return frames
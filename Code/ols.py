@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+
+# regress every column of Y on one shared design (x plus a constant) with a single least-squares solve
+# returns one row per dependent column: coefficients, std. errors, t-stats, p-values, r-squared, observations
+# columns with missing values are refit on their own complete rows
+# (scipy is only needed for the p-values, so it is imported here rather than by everyone using Moments)
+def batch_ols(x, Y, names=None, regressors=None):
+    from scipy import stats
+
+    x = np.asarray(x, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    Y = Y.reshape(len(Y), -1)
+    if regressors is None:
+        regressors = ['Slope'] if x.ndim == 1 else [f'x{i + 1}' for i in range(x.shape[1])]
+    regressors = ['Intercept'] + list(regressors)
+    X = np.column_stack([np.ones(len(x)), x])
+    p = X.shape[1]
+    m = Y.shape[1]
+
+    coef = np.full((m, p), np.nan)
+    se = np.full((m, p), np.nan)
+    r2 = np.full(m, np.nan)
+    nobs = np.zeros(m, np.int64)
+
+    def fit(rows, columns):
+        Xr, Yr = X[rows], Y[rows][:, columns]
+        beta = np.linalg.lstsq(Xr, Yr, rcond=None)[0]
+        resid = Yr - Xr @ beta
+        ssr = np.einsum('ij,ij->j', resid, resid)
+        centred = Yr - Yr.mean(axis=0)
+        dof = len(Xr) - p
+        sigma2 = ssr / dof if dof > 0 else np.full(len(columns), np.nan)
+        unscaled = np.diag(np.linalg.pinv(Xr.T @ Xr))
+        coef[columns] = beta.T
+        se[columns] = np.sqrt(np.outer(sigma2, unscaled))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r2[columns] = 1 - ssr / np.einsum('ij,ij->j', centred, centred)
+        nobs[columns] = len(Xr)
+
+    complete_x = ~np.isnan(X).any(axis=1)
+    missing = np.isnan(Y[complete_x]).any(axis=0)
+    if (~missing).any():
+        fit(complete_x, np.flatnonzero(~missing))
+    for column in np.flatnonzero(missing):
+        rows = complete_x & ~np.isnan(Y[:, column])
+        if rows.sum() >= p:
+            fit(rows, [column])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tvalues = coef / se
+    pvalues = 2 * stats.t.sf(np.abs(tvalues), (nobs - p)[:, None])
+
+    table = {}
+    for i, regressor in enumerate(regressors):
+        table[regressor] = coef[:, i]
+        table[f'{regressor} Std. Error'] = se[:, i]
+        table[f'{regressor} t'] = tvalues[:, i]
+        table[f'{regressor} P>|t|'] = pvalues[:, i]
+    table['R-squared'] = r2
+    table['Observations'] = nobs
+    return pd.DataFrame(table, index=names)
+
+
+# co-moments of y on x from the sums of a simple regression (n, sum x, sum y, sum x^2, sum y^2, sum xy), for
+# sums of any (broadcastable) shape: one pair, days x pairs, tickers x tickers
+# cov / var_x / var_y are sums of products about the means (n times the population moments), which cancels
+# in corr and slope; x and y should be centred near their means first so the sums stay small and the
+# differences here do not cancel (volume is in the billions, an index runs into the tens of thousands)
+# corr is clipped to [-1, 1]; divisions by zero give NaN or inf quietly, for callers to mask
+def comoments(sx, sy, sxx, syy, sxy, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        corr = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+        slope = cov / var_x
+    return cov, var_x, var_y, corr, slope
+
+
+class Moments:
+
+    # sums needed for a simple regression of y on x (n, sum x, sum y, sum x^2, sum xy, sum y^2)
+    # gathered in one pass over the rows where both are present, instead of a full df.cov()/df.var()
+    def __init__(self, x, y):
+        pair = np.vstack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+        pair = pair[:, ~np.isnan(pair).any(axis=0)]
+        self.n = pair.shape[1]
+        # sums are taken about the first point (see comoments)
+        self.shift = pair[:, 0].copy() if self.n else np.zeros(2)
+        pair = pair - self.shift[:, None]
+        self.sx, self.sy = pair.sum(axis=1)
+        (self.sxx, self.sxy), (_, self.syy) = pair @ pair.T
+        self.comoments = comoments(self.sx, self.sy, self.sxx, self.syy, self.sxy, self.n)
+
+    @property
+    def mean_x(self):
+        return self.sx / self.n + self.shift[0]
+
+    @property
+    def mean_y(self):
+        return self.sy / self.n + self.shift[1]
+
+    # sample (n - 1) covariance and variances, as pandas reports them
+    @property
+    def cov(self):
+        return self._sample(self.comoments[0])
+
+    @property
+    def var_x(self):
+        return self._sample(self.comoments[1])
+
+    @property
+    def var_y(self):
+        return self._sample(self.comoments[2])
+
+    def _sample(self, value):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return value / np.float64(self.n - 1)
+
+    @property
+    def slope(self):
+        return self.comoments[4]
+
+    @property
+    def intercept(self):
+        return self.mean_y - self.mean_x * self.slope
+
+    @property
+    def corr(self):
+        return self.comoments[3]
+
+    # fitted values at x
+    def line(self, x):
+        return x * self.slope + self.intercept
+
+
+# moments of frame[y] on frame[x], memoized in `cache` under the column names so overlays,
+# scatter fits and trend lines over the same series share one pass
+def fit(cache, frame, x, y):
+    key = (x, y)
+    if key not in cache:
+        cache[key] = Moments(frame[x], frame[y])
+    return cache[key]
@@ -0,0 +1,148 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# opt-in: stays off unless enable() is called or PROFILE=1 is set; while off, stage() hands back one
+# shared do-nothing context, timed() functions make one flag check and count() returns straight away,
+# so the hooks can stay in the production path
+ENABLED = os.environ.get('PROFILE', '') not in ('', '0')
+
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+class _Off:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_OFF = _Off()
+
+
+class _Stage:
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        with _lock:
+            _events.append((self.name, self.start, end, os.getpid(), threading.get_ident(), self.args))
+        return False
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+# forget every recorded stage and counter
+def reset():
+    global _origin
+    with _lock:
+        _events.clear()
+        _counters.clear()
+        _origin = time.perf_counter()
+
+
+# time a block: `with stage('Research.rolling corr', pairs=6): ...`; keyword args are kept with the event
+def stage(name, **args):
+    if not ENABLED:
+        return _OFF
+    return _Stage(name, args)
+
+
+# time every call of a function as a stage, named after its qualified name unless `name` is given
+def timed(name=None):
+    def decorate(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Stage(label, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# add to a named counter (rows processed, bytes read, figures written, ...)
+def count(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+# calls, total / max seconds per stage name and every counter
+def summary():
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    stages = {}
+    for name, start, end, *_ in events:
+        entry = stages.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0})
+        entry['calls'] += 1
+        entry['total'] += end - start
+        entry['max'] = max(entry['max'], end - start)
+    return {'stages': stages, 'counters': counters}
+
+
+# summary() as json
+def export_json(path):
+    with open(path, 'w') as f:
+        json.dump(summary(), f, indent=2)
+
+
+# every stage as a complete ('X') event of the chrome trace format (chrome://tracing, perfetto), counters
+# as one counter ('C') event at the end
+def export_trace(path):
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    trace = [{'name': name, 'ph': 'X', 'ts': (start - _origin) * 1e6, 'dur': (end - start) * 1e6,
+              'pid': pid, 'tid': tid, 'args': args}
+             for name, start, end, pid, tid, args in events]
+    if counters:
+        last = max((end for _, _, end, *_ in events), default=_origin)
+        trace.append({'name': 'counters', 'ph': 'C', 'ts': (last - _origin) * 1e6, 'pid': os.getpid(),
+                      'args': counters})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+# profile just the block, then write the json summary and/or chrome trace if paths are given
+@contextmanager
+def profiled(json_path=None, trace_path=None):
+    was = ENABLED
+    reset()
+    enable()
+    try:
+        yield
+    finally:
+        if not was:
+            disable()
+        if json_path is not None:
+            export_json(json_path)
+        if trace_path is not None:
+            export_trace(trace_path)
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+import loader
+from incremental import Tracker
+from profiler import count, stage
+from stream import find_date, tail_offset
+
+HEADER = ','.join(loader.COLUMNS)
+
+
+# date (YYYY-MM-DD) of the last row of a csv, or None when it has no rows (or does not exist yet)
+def last_date(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(tail_offset(path, 1, nulls=True))
+        line = f.readline().strip()
+    if not line or line.decode() == HEADER:
+        return None
+    return line.split(b',', 1)[0].decode()
+
+
+# data lines of a csv body dated after `after`, exactly as the source wrote them
+def parse(text, after=None):
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != HEADER:
+        raise ValueError(f'expected a csv with header {HEADER!r}')
+    rows = [line for line in lines[1:] if line.strip()]
+    return rows if after is None else [line for line in rows if line.split(',', 1)[0] > after]
+
+
+# append lines to a csv with one write, truncating back to the old size if anything fails part way,
+# so readers (and the column store's size check) never see half a row; a new ticker's csv gets the header
+def append(path, lines):
+    if not lines:
+        return 0
+    with open(path, 'a+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        # the yahoo exports have no trailing newline, and appends keep it that way
+        f.seek(max(size - 1, 0))
+        newline = size > 0 and f.read(1) != b'\n'
+        data = (('\n' if newline else '') + '\n'.join(lines if size else [HEADER] + lines)).encode()
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(size)
+            raise
+    count('bytes appended', len(data))
+    return len(lines)
+
+
+class LocalSource:
+
+    # stand-in source serving bars from a directory of csvs in the Data/*.csv schema (e.g. a mirror or a
+    # fixture); only the rows after the requested date are read, found by binary search
+    errors = ()
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    async def fetch(self, ticker, after=None):
+        return await asyncio.to_thread(self.read, ticker, after)
+
+    def read(self, ticker, after):
+        path = loader.csv_path(ticker, self.directory)
+        offset = 0
+        if after is not None:
+            offset = find_date(path, np.datetime64(after) + 1)
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(max(offset, f.tell()))
+            body = f.read()
+        return parse(header.decode() + body.decode(), after)
+
+    async def close(self):
+        pass
+
+
+class HTTPSource:
+
+    # bars over http through one shared aiohttp session, so connections are reused across tickers
+    # url is a template with {ticker} and optionally {start} (first missing day, YYYY-MM-DD, or '' for all);
+    # the response must be a csv in the Data/*.csv schema
+    def __init__(self, url, connections=16, timeout=30):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('HTTPSource needs aiohttp (pip install aiohttp)') from None
+        self.aiohttp = aiohttp
+        # dropped connections and broken payloads are worth retrying; so are 5xx / 429 responses (see fetch)
+        self.errors = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+        self.url = url
+        self.connections = connections
+        self.timeout = timeout
+        self.session = None
+
+    async def fetch(self, ticker, after=None):
+        if self.session is None:
+            self.session = self.aiohttp.ClientSession(
+                connector=self.aiohttp.TCPConnector(limit=self.connections),
+                timeout=self.aiohttp.ClientTimeout(total=self.timeout))
+        start = '' if after is None else str(np.datetime64(after) + 1)
+        async with self.session.get(self.url.format(ticker=ticker, start=start)) as response:
+            if response.status >= 500 or response.status == 429:
+                raise ConnectionError(f'{ticker}: http {response.status}')
+            # any other error status (e.g. 404 for an unknown ticker) fails without retrying
+            response.raise_for_status()
+            text = await response.text()
+        return parse(text, after)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class Refresher:
+
+    # brings Data/*.csv up to date from `source` for many tickers at once
+    # at most `concurrency` tickers are fetched at a time; a fetch that fails with a transient error (timeout,
+    # connection error, or the source's own `errors`) is retried `retries` times with exponential backoff,
+    # anything else (a missing or unreadable file, a bad csv) fails straight away; a ticker that fails is left
+    # untouched and reported in `errors`
+    # after an append, the ticker's incremental Tracker (if given) picks up just the new rows and every
+    # listener is called with (ticker, rows appended); a failed append, tracker refresh or listener is that
+    # ticker's error too, and never stops the other tickers
+    def __init__(self, source, directory='.', concurrency=16, retries=3, backoff=.5, trackers=None,
+                 listeners=()):
+        self.source = source
+        self.directory = directory
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.trackers = {} if trackers is None else trackers
+        self.listeners = list(listeners)
+        self.errors = {}
+        # new indicator rows from each ticker's tracker after the last refresh
+        self.updates = {}
+
+    async def fetch(self, ticker, after):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.source.fetch(ticker, after)
+            except (TimeoutError, asyncio.TimeoutError, ConnectionError) + tuple(self.source.errors):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def one(self, ticker, semaphore):
+        path = loader.csv_path(ticker, self.directory)
+        async with semaphore:
+            try:
+                after = await asyncio.to_thread(last_date, path)
+                lines = await self.fetch(ticker, after)
+            except Exception as error:
+                self.errors[ticker] = error
+                return 0
+        try:
+            appended = await asyncio.to_thread(append, path, lines)
+        except Exception as error:
+            self.errors[ticker] = error
+            return 0
+        count('rows fetched', appended)
+        # the rows are in the csv by now, so they are counted even if what follows fails
+        try:
+            if appended and ticker in self.trackers:
+                self.updates[ticker] = await asyncio.to_thread(self.trackers[ticker].refresh)
+            for listener in self.listeners:
+                listener(ticker, appended)
+        except Exception as error:
+            self.errors[ticker] = error
+        return appended
+
+    # rows appended per ticker
+    async def refresh(self, tickers):
+        self.errors = {}
+        self.updates = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with stage('refresh', tickers=len(tickers)):
+            counts = await asyncio.gather(*(self.one(ticker, semaphore) for ticker in tickers))
+        return dict(zip(tickers, counts))
+
+    async def close(self):
+        await self.source.close()
+
+
+# refresh `tickers` once from a source and return (rows appended per ticker, errors per ticker)
+def run(tickers, source, directory='.', **options):
+    async def main():
+        refresher = Refresher(source, directory, **options)
+        try:
+            return await refresher.refresh(list(tickers)), refresher.errors
+        finally:
+            await refresher.close()
+    return asyncio.run(main())
+
+
+# keep the trackers of `tickers` in step with the csvs: refresh from the source and return each ticker's
+# new indicator rows (see incremental.Tracker)
+def run_tracked(tickers, source, directory='.', **options):
+    trackers = {ticker: Tracker.load(ticker, directory) for ticker in tickers}
+    # catch up on anything appended before this run, so the updates are only this run's rows
+    for ticker, tracker in trackers.items():
+        if os.path.exists(loader.csv_path(ticker, directory)):
+            tracker.refresh()
+
+    async def main():
+        refresher = Refresher(source, directory, trackers=trackers, **options)
+        try:
+            await refresher.refresh(list(tickers))
+            return refresher.updates, refresher.errors
+        finally:
+            await refresher.close()
+    updates, errors = asyncio.run(main())
+    for tracker in trackers.values():
+        tracker.save()
+    return updates, errors
+
+
+# python refresh.py <source directory or url template> <ticker> ...  (run from Data/)
+if __name__ == '__main__':
+    origin, *names = sys.argv[1:]
+    feed = HTTPSource(origin) if origin.startswith(('http://', 'https://')) else LocalSource(origin)
+    appended, failed = run(names, feed)
+    for name, rows in appended.items():
+        print(f'{name}: {rows} new rows' + (f' (failed: {failed[name]!r})' if name in failed else ''))
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+
+import loader
+from profiler import count, stage
+
+MANIFEST = '.render_manifest.json'
+
+# empty figure rendered to start a renderer
+BLANK = {'data': [], 'layout': {}}
+# process that started the kaleido sync server (a forked worker must start its own)
+_server = {}
+
+
+# keep one headless chrome open for every export in this process
+# this assumes plotly >= 6.1 with kaleido >= 1.0, where pio.to_image otherwise starts a fresh chrome per call
+# unless kaleido's sync server is running (plotly's own gallery scraper starts it for the same reason);
+# kaleido 0.x keeps a persistent renderer by itself and has no sync server, so there is nothing to start
+# the server is stopped when the process exits, pool workers included (they skip atexit handlers)
+def start():
+    import plotly.io as pio
+
+    if _server.get('pid') == os.getpid():
+        return
+    # one export without the server first: it raises plainly when there is no browser to run, whereas a sync
+    # server whose browser fails to start would leave every later export waiting on it
+    pio.to_image(BLANK, format='png', width=16, height=16)
+    _server['pid'] = os.getpid()
+    try:
+        from kaleido import start_sync_server, stop_sync_server
+    except ImportError:
+        return
+    start_sync_server(silence_warnings=True)
+    Finalize(None, stop_sync_server, kwargs={'silence_warnings': True}, exitpriority=10)
+
+
+# start the static image renderer once so every later export in this process reuses it
+# plotly is imported on first render so queueing code stays importable without it
+def warm():
+    import plotly.io as pio
+
+    start()
+    pio.to_image(BLANK, format='png', width=16, height=16)
+
+
+# render one batch of (figure json, path, options) specs through this process's renderer; runs inside a worker
+# (or in the queue's own process for a single batch)
+def render(specs):
+    import plotly.io as pio
+
+    start()
+    for fig_json, path, options in specs:
+        image = pio.to_image(json.loads(fig_json), format=os.path.splitext(path)[1][1:] or 'png', validate=False,
+                             **options)
+        loader.replace_file(path, lambda f: f.write(image))
+    return [path for _, path, _ in specs]
+
+
+# path -> hash of the figure last written there, empty when there is no readable manifest
+def read_manifest(manifest):
+    try:
+        with open(manifest) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class RenderQueue:
+
+    # collects figures and writes them as images in batches across a pool of warm renderer processes
+    # a figure is skipped when its json and export options hash the same as the last time that file was written
+    # workers=0 renders in this process instead, which is also the default on a single core
+    # workers is an upper bound: a flush starts no more renderer processes than it has batches (each one warms
+    # its own renderer), and a single batch is rendered in this process
+    def __init__(self, workers=None, batch=4, manifest=MANIFEST):
+        if workers is None:
+            workers = os.cpu_count() if (os.cpu_count() or 1) > 1 else 0
+        self.workers = workers
+        self.batch = batch
+        self.manifest = manifest
+        self.pending = []
+        self.skipped = []
+        self.written = []
+        self.pool = None
+        self.size = 0
+        self.hashes = read_manifest(self.manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.flush()
+        self.close()
+
+    def add(self, fig, path, **options):
+        fig_json = fig.to_json()
+        digest = hashlib.sha1((fig_json + json.dumps(options, sort_keys=True)).encode()).hexdigest()
+        if self.hashes.get(path) == digest and os.path.exists(path):
+            self.skipped.append(path)
+            count('figures skipped')
+            return
+        self.pending.append((digest, (fig_json, path, options)))
+
+    # render everything queued so far
+    def flush(self):
+        if not self.pending:
+            return []
+        digests = {spec[1]: digest for digest, spec in self.pending}
+        specs = [spec for _, spec in self.pending]
+        self.pending = []
+        batches = [specs[i:i + self.batch] for i in range(0, len(specs), self.batch)]
+
+        workers = min(self.workers, len(batches))
+        done = []
+        # batches that finished are recorded even when another one fails, then the error is raised
+        try:
+            with stage('render', figures=len(specs), workers=workers):
+                if workers <= 1:
+                    for batch in batches:
+                        done += render(batch)
+                else:
+                    # an earlier, smaller flush's pool is replaced only when this one needs more processes
+                    if self.size < workers:
+                        self.close()
+                        self.pool = ProcessPoolExecutor(workers, initializer=warm)
+                        self.size = workers
+                    futures = [self.pool.submit(render, batch) for batch in batches]
+                    error = None
+                    for future in as_completed(futures):
+                        try:
+                            done += future.result()
+                        except Exception as e:
+                            error = error or e
+                    if error is not None:
+                        raise error
+        finally:
+            count('figures written', len(done))
+            self.record({path: digests[path] for path in done})
+            self.written += done
+        return done
+
+    # merge `entries` into the manifest on disk as it is now, so queues in other processes keep theirs
+    def record(self, entries):
+        if not entries:
+            return
+        hashes = read_manifest(self.manifest)
+        hashes.update(entries)
+        loader.replace_file(self.manifest, lambda f: json.dump(hashes, f), 'w')
+        self.hashes = hashes
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.size = 0
+
+
+# write one figure through `queue` if given, otherwise straight away (still skipping unchanged files)
+def export(fig, path, queue=None, **options):
+    if queue is not None:
+        queue.add(fig, path, **options)
+        return
+    with RenderQueue(workers=0) as single:
+        single.add(fig, path, **options)
+
+
+# yield `queue` as is, or a fresh queue that is flushed when the block ends
+@contextmanager
+def queued(queue=None):
+    if queue is not None:
+        yield queue
+        return
+    with RenderQueue() as fresh:
+        yield fresh
@@ -0,0 +1,175 @@
+import numpy as np
+
+from ols import comoments
+
+# bytes of working arrays a sweep batch may use, and how many days-long float64 arrays each pair in a batch
+# needs at the peak (measured: 5 prefix sums and the counts, the gathered and zero-filled inputs while they are
+# summed, then 5 window sums, their counts and the correlation's temporaries)
+SWEEP_MEMORY = 256 << 20
+SWEEP_ARRAYS = 24
+
+
+# every unordered (i, j) pair of n columns
+def all_pairs(n):
+    return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+
+# compensated (kahan) in-place add of value into total, carrying the lost low bits in comp
+def kahan_add(total, comp, value):
+    y = value - comp
+    t = total + y
+    comp[...] = (t - total) - y
+    total[...] = t
+
+
+class RollingSums:
+
+    # streaming sums over the last `window` rows of each column, with kahan-compensated running totals
+    # and a ring buffer of the rows still inside the window; NaN marks a missing value
+    # the state is plain arrays, so it can be pickled and resumed when more rows arrive
+    def __init__(self, window, columns):
+        self.window = window
+        self.sums = np.zeros(columns)
+        self.comp = np.zeros(columns)
+        self.count = np.zeros(columns, np.int64)
+        self.ring = np.zeros((window, columns))
+        self.ring_valid = np.zeros((window, columns), bool)
+        self.pos = 0
+
+    # push rows (n x columns) through the window and return the window sums and counts after each row
+    # rows are handled in steps of up to `window`, whose leaving terms are exactly the ring buffer slots they
+    # overwrite, so each step is a handful of array ops instead of a python loop per row
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        # explicit row count, so a set of zero columns (no pairs) still reshapes
+        rows = rows.reshape(len(rows) if rows.ndim > 1 else -1, len(self.sums))
+        sums = np.empty(rows.shape)
+        counts = np.empty(rows.shape, np.int64)
+        for start in range(0, len(rows), self.window):
+            stop = start + self.window
+            sums[start:stop], counts[start:stop] = self._step(rows[start:stop])
+        return sums, counts
+
+    def _step(self, rows):
+        valid = ~np.isnan(rows)
+        terms = np.where(valid, rows, 0.0)
+
+        # new rows enter, the rows that were `window` steps earlier leave
+        slots = (self.pos + np.arange(len(rows))) % self.window
+        change = np.cumsum(terms - self.ring[slots], axis=0)
+        sums = (self.sums - self.comp) + change
+        counts = self.count + np.cumsum(valid.astype(np.int64) - self.ring_valid[slots], axis=0)
+
+        kahan_add(self.sums, self.comp, change[-1])
+        self.count = counts[-1]
+        self.ring[slots] = terms
+        self.ring_valid[slots] = valid
+        self.pos = (self.pos + len(rows)) % self.window
+        return sums, counts
+
+
+class RollingCorr:
+
+    # streaming rolling pearson correlation for a fixed set of column pairs
+    # keeps running sums of x, y, x^2, y^2 and xy per pair (see RollingSums), so each new row costs O(pairs)
+    # no matter how long the window is
+    # a pair only counts rows where both columns are present, like DataFrame.rolling(window).corr()
+    def __init__(self, window, pairs, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+        self.sums = RollingSums(window, 5 * len(self.pairs))
+        # per-column shift (first value seen), so the sums stay small (see ols.comoments)
+        self.shift = None
+
+    # push rows (n x columns) and return the correlation of every pair after each row
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        rows = rows.reshape(-1, rows.shape[-1])
+        if self.shift is None:
+            self.shift = np.full(rows.shape[1], np.nan)
+        if np.isnan(self.shift).any() and len(rows):
+            first = rows[np.argmax(~np.isnan(rows), axis=0), np.arange(rows.shape[1])]
+            self.shift = np.where(np.isnan(self.shift), first, self.shift)
+        centred = rows - self.shift
+        x, y = centred[:, self.pairs[:, 0]], centred[:, self.pairs[:, 1]]
+        # a row missing either side counts for neither
+        x = np.where(np.isnan(y), np.nan, x)
+        y = np.where(np.isnan(x), np.nan, y)
+        sums, counts = self.sums.update(np.hstack([x, y, x * x, y * y, x * y]))
+        count = len(self.pairs)
+        return self.corr(sums.reshape(len(rows), 5, count).transpose(1, 0, 2), counts[:, :count])
+
+    # correlation of every pair from window sums (5 x ... x pairs) and counts
+    def corr(self, sums, n):
+        _, var_x, var_y, r, _ = comoments(*sums, n)
+        r[(n < self.min_periods) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+        return r
+
+
+# rolling correlation of the given column pairs over a days x columns block, as a days x pairs array
+def rolling_corr(block, window, pairs=None, min_periods=None):
+    block = np.asarray(block)
+    pairs = all_pairs(block.shape[1]) if pairs is None else pairs
+    return RollingCorr(window, pairs, min_periods).update(block)
+
+
+# prefix sums of x, y, x^2, y^2 and xy (5 x days+1 x columns) and prefix counts of the rows where both are
+# present, for the column-wise pairs of two days x columns arrays; a row missing either side counts for neither
+# the sums over any window are then just a difference of two prefix rows (see window_sums)
+# the terms are formed one at a time in a single scratch array, so only the prefix sums are ever held whole
+def prefix_sums(x, y):
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    days, columns = x.shape
+    prefix = np.zeros((5, days + 1, columns))
+    np.cumsum(x, axis=0, out=prefix[0, 1:])
+    np.cumsum(y, axis=0, out=prefix[1, 1:])
+    term = np.empty_like(x)
+    for k, (a, b) in enumerate(((x, x), (y, y), (x, y)), 2):
+        np.multiply(a, b, out=term)
+        np.cumsum(term, axis=0, out=prefix[k, 1:])
+    counts = np.zeros((days + 1, columns), np.int64)
+    np.cumsum(valid, axis=0, out=counts[1:])
+    return prefix, counts
+
+
+# (sx, sy, sxx, syy, sxy) and counts over the `window` rows ending at each row from window - 1 on,
+# or over every row so far when window is None (expanding)
+def window_sums(prefix, counts, window=None):
+    if window is None:
+        return prefix[:, 1:], counts[1:]
+    return prefix[:, window:] - prefix[:, :-window], counts[window:] - counts[:-window]
+
+
+# rolling correlation of the given column pairs for every window size in `windows`, as a days x windows x pairs array
+# the x, y, x^2, y^2, xy terms are prefix-summed once and each window is just a difference of two prefix rows,
+# so adding a window costs one subtraction per cell instead of another pass over the data
+# pairs are processed in batches whose working arrays fit in `memory` bytes (or `batch` pairs at a time);
+# the result is written into `out` if given, else a new array of `dtype` (float32 halves it)
+def sweep(block, windows, pairs=None, batch=None, memory=SWEEP_MEMORY, dtype=np.float64, out=None):
+    block = np.asarray(block, dtype=np.float64)
+    days = len(block)
+    pairs = np.asarray(all_pairs(block.shape[1]) if pairs is None else pairs, dtype=np.intp).reshape(-1, 2)
+    windows = list(windows)
+    if out is None:
+        out = np.empty((days, len(windows), len(pairs)), dtype)
+    out[...] = np.nan
+    if batch is None:
+        batch = max(1, memory // ((days + 1) * 8 * SWEEP_ARRAYS))
+
+    # centre every column on its mean so the prefix sums stay near zero and differences keep their precision
+    centred = block - np.nanmean(block, axis=0)
+    for first in range(0, len(pairs), batch):
+        chunk = pairs[first:first + batch]
+        prefix, counts = prefix_sums(centred[:, chunk[:, 0]], centred[:, chunk[:, 1]])
+
+        for k, window in enumerate(windows):
+            if window > days:
+                continue
+            sums, n = window_sums(prefix, counts, window)
+            _, var_x, var_y, r, _ = comoments(*sums, n)
+            r[(n < window) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+            out[window - 1:, k, first:first + len(chunk)] = r
+    return out
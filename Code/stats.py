@@ -0,0 +1,163 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+SKETCH_K = 2048
+
+
+class Sketch:
+
+    # mergeable quantile sketch (KLL style): level h holds items that each stand for 2^h values
+    # a level over capacity is sorted and every other item (random offset) is promoted to the next level,
+    # so memory stays O(k) and rank error is about 1/k; until the first compaction the answers are exact
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        # lower levels get geometrically less room than the top one
+        return max(int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))), 2)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.compress()
+        return self
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                items = np.sort(items)
+                # an odd item out stays behind so no weight is lost
+                keep = items[:1] if len(items) % 2 else items[:0]
+                pairs = items[len(keep):]
+                promoted = pairs[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def count(self):
+        return sum(len(items) << level for level, items in enumerate(self.levels))
+
+    def quantile(self, q):
+        if len(self.levels) == 1:
+            # nothing compacted yet: exact, with the same interpolation as pandas
+            return np.quantile(self.levels[0], q) if len(self.levels[0]) else np.nan
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(kept), 1 << level) for level, kept in enumerate(self.levels)])
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        rank = np.searchsorted(cumulative, q * cumulative[-1])
+        return items[order][min(rank, len(items) - 1)]
+
+
+class Summary:
+
+    # one-pass, mergeable summary of a series: count, mean and variance (welford, chunks combined with
+    # chan's formula), min, max, absolute min and a quantile sketch for median/percentiles; NaN is skipped
+    # a summary of one in-memory update that was never merged keeps its values and answers quantiles exactly;
+    # only chunked / merged summaries fall back to the sketch
+    def __init__(self, k=SKETCH_K):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.abs_min = np.inf
+        self.sketch = Sketch(k)
+        self.values = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        chunk = Summary.__new__(Summary)
+        chunk.n = len(values)
+        chunk.mean = values.mean()
+        chunk.m2 = np.square(values - chunk.mean).sum()
+        chunk.min, chunk.max, chunk.abs_min = values.min(), values.max(), np.abs(values).min()
+        self.values = values if self.n == 0 else None
+        self.sketch.update(values)
+        return self._combine(chunk)
+
+    def merge(self, other):
+        if other.n:
+            self.values = None
+        self.sketch.merge(other.sketch)
+        return self._combine(other)
+
+    def _combine(self, other):
+        n = self.n + other.n
+        if other.n:
+            delta = other.mean - self.mean
+            self.mean += delta * other.n / n
+            self.m2 += other.m2 + delta * delta * self.n * other.n / n
+            self.n = n
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            self.abs_min = min(self.abs_min, other.abs_min)
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+    def quantile(self, q):
+        if not self.n:
+            return np.nan
+        return np.quantile(self.values, q) if self.values is not None else self.sketch.quantile(q)
+
+    @property
+    def median(self):
+        return self.quantile(.5)
+
+    def stat(self, name):
+        return STATS[name](self) if self.n else np.nan
+
+
+# summary statistics by their table column name
+STATS = {
+    'Count': lambda s: s.n,
+    'Median': lambda s: s.median,
+    'Mean': lambda s: s.mean,
+    'Std. Deviation': lambda s: s.std,
+    'Min': lambda s: s.min,
+    'Max': lambda s: s.max,
+    'Absolute Min': lambda s: s.abs_min,
+    '25th percentile': lambda s: s.quantile(.25),
+    '50th percentile': lambda s: s.quantile(.5),
+    '75th percentile': lambda s: s.quantile(.75),
+}
+
+
+# summary of each series, computed in a pool when one is given (the summaries merge back losslessly)
+def summarize(series, pool=None, k=SKETCH_K):
+    if pool is None:
+        return [Summary(k).update(values) for values in series]
+    # k is bound up front, so this works with multiprocessing.Pool.map as well as executor.map
+    return list(pool.map(functools.partial(_summarize_one, k=k), series))
+
+
+def _summarize_one(values, k=SKETCH_K):
+    return Summary(k).update(values)
+
+
+# one row per name with the requested STATS columns, built in one go
+def table(names, summaries, columns):
+    data = {'Name': list(names)}
+    for column in columns:
+        data[column] = [summary.stat(column) for summary in summaries]
+    return pd.DataFrame(data)
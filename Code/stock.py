@@ -2,99 +2,225 @@ import math
 
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import time
+
+import lod
+import stream
+import volret
+from align import Aligned
+from features import frame
+from indicators import COLORS, Pipeline
+from loader import csv_path
+from ols import fit
+from profiler import count, stage, timed
+from render import RenderQueue, export
 
 
 class Graph:
 
-    def __init__(self, ticker, period=None):
+    # start/end restrict the chart to a date range; with chunksize the rows are streamed from the csv
+    # (seeking straight to the range/period) instead of going through the column store
+    # headless=True is for signal jobs: only values()/signals() are available and plotly is never imported
+    def __init__(self, ticker, period=None, start=None, end=None, chunksize=None, headless=False):
         self.ticker = ticker
+        self.headless = headless
+        # the whole history is charted from the ticker's cached lod pyramid; other ranges build their own
+        self.full = chunksize is None and period is None and start is None and end is None
+        self._levels = None
         self.period = period
-        self.df = pd.read_csv(f'{self.ticker}.csv')
-        if self.period is not None:
-            self.df = self.df.tail(self.period)
-        self.df['Avg Price'] = (self.df['High'] + self.df['Low'] + self.df['Close']) / 3
+        self.start = start
+        self.end = end
+        with stage('Graph.load', ticker=ticker):
+            if chunksize is not None:
+                self.df = pd.concat(stream.indicators(csv_path(self.ticker), chunksize, start, end, period),
+                                    ignore_index=True)
+            else:
+                self.df = frame(self.ticker)
+                if start is not None or end is not None:
+                    self.df = self.df.iloc[self.rows(start, end)]
+                if self.period is not None:
+                    self.df = self.df.tail(self.period)
+        count('rows processed', len(self.df))
         self.df['Index'] = np.arange(len(self.df))
-        self.fig = go.Figure(
-            data=go.Candlestick(open=self.df['Open'], close=self.df['Close'], high=self.df['High'], low=self.df['Low'],
-                                name=''))
-        self.fig.update_layout(xaxis_rangeslider_visible=False)
 
-    def download(self):
+        # indicators are only declared here; they are computed and drawn when a figure is first needed
+        self.pipeline = Pipeline()
+        self.traces = []
+        self._fig = None
+
+    # full-history figure, built on first use and rebuilt after new indicators are declared
+    @property
+    def fig(self):
+        if self._fig is None:
+            self._fig = self.figure()
+        return self._fig
+
+    # rows whose date lies between start and end
+    def rows(self, start=None, end=None):
+        dates = self.df['Date'].to_numpy()
+        first = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start)))
+        last = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), 'right')
+        return slice(first, last)
+
+    # every declared indicator, evaluated in one pass over the whole history
+    def values(self):
+        return self.pipeline.evaluate(self.df['High'].to_numpy(), self.df['Low'].to_numpy(),
+                                      self.df['Close'].to_numpy(), self.df['Volume'].to_numpy(),
+                                      self.df['Index'].to_numpy())
+
+    # declared indicators as numpy arrays keyed by column (with Date and Index), or as a pyarrow Table
+    def signals(self, arrow=False):
+        values = self.values() if self.pipeline.steps else {}
+        columns = {'Date': self.df['Date'].to_numpy(), 'Index': self.df['Index'].to_numpy()}
+        for step in self.pipeline.steps:
+            for name in self.pipeline.outputs(step):
+                columns[name] = values[name]
+        if arrow:
+            import pyarrow as pa
+            return pa.table(columns)
+        return columns
+
+    # daily, weekly and monthly candles of this graph's rows
+    def levels(self):
+        if self._levels is None:
+            self._levels = lod.pyramid(self.ticker) if self.full else lod.build(self.df)
+        return self._levels
+
+    # candlesticks and indicator traces for just the rows between start and end
+    # long ranges are drawn with weekly/monthly candles and decimated lines (at most `points` each, see lod),
+    # so the figure stays the same size however long the history is; points=None draws every row
+    # plotly is only imported here (and in the other plotting functions), so numeric use never pays for it
+    @timed('Graph.figure')
+    def figure(self, start=None, end=None, points=lod.POINTS):
+        if self.headless:
+            raise RuntimeError(f'{self.ticker} Graph is headless; use values() or signals()')
+        import plotly.graph_objects as go
+
+        rows = self.rows(start, end)
+        candles = lod.candles(self.levels(), rows.start, rows.stop, points)
+        fig = go.Figure(
+            data=go.Candlestick(x=candles['Index'], open=candles['Open'], close=candles['Close'],
+                                high=candles['High'], low=candles['Low'], name=''))
+        x = self.df['Index'].to_numpy()[rows]
+        values = self.values() if self.pipeline.steps else {}
+        for step in self.pipeline.steps:
+            for name in self.pipeline.outputs(step):
+                y = values[name][rows]
+                keep = lod.decimate(y, x, points)
+                fig.add_trace(go.Scatter(x=x[keep], y=y[keep], name=self.pipeline.label(step, name),
+                                         line_color=COLORS[step[0]]))
+        for trace in self.traces:
+            if 'x' not in trace:
+                keep = lod.decimate(trace['y'], points=points)
+                trace = dict(trace, x=keep, y=np.asarray(trace['y'])[keep])
+            fig.add_trace(go.Scatter(**trace))
+        fig.update_layout(xaxis_rangeslider_visible=False)
+        return fig
+
+    def download(self, queue=None, start=None, end=None, points=lod.POINTS):
         if self.period is None:
             tag = 'MAX'
         else:
             tag = self.period
-        self.fig.write_image(f'{self.ticker}{tag}.png', width=3840, height=2160, scale=2)
+        fig = self.fig if (start, end, points) == (None, None, lod.POINTS) else self.figure(start, end, points)
+        export(fig, f'{self.ticker}{tag}.png', queue, width=3840, height=2160, scale=2)
 
-    def display(self):
-        self.fig.update_layout(xaxis_rangeslider_visible=True)
-        self.fig.show()
-        self.fig.update_layout(xaxis_rangeslider_visible=False)
+    def display(self, start=None, end=None, points=lod.POINTS):
+        fig = self.fig if (start, end, points) == (None, None, lod.POINTS) else self.figure(start, end, points)
+        fig.update_layout(xaxis_rangeslider_visible=True)
+        fig.show()
+        fig.update_layout(xaxis_rangeslider_visible=False)
 
     # ========== #
     # INDICATORS #
     # ========== #
 
+    # stream indicator values chunk by chunk without holding the whole history (or building a figure)
+    # settings are the same as incremental.Indicators, e.g. scan(sma=(20, 50), bb=((20, 2),))
+    def scan(self, chunksize=stream.CHUNKSIZE, **settings):
+        return stream.indicators(csv_path(self.ticker), chunksize, self.start, self.end, self.period, **settings)
+
     def add_sma(self, period=20):
-        sma = self.df['Avg Price'].rolling(window=period).mean()
-        self.fig.add_trace(go.Scatter(y=sma, name=f'SMA{period}', line_color='#000000'))
+        self.pipeline.add('sma', period)
+        self._fig = None
 
     def add_ema(self, period=20):
-        df = self.df.sort_index()
-        ema = df['Avg Price'].ewm(span=period, min_periods=0, adjust=False, ignore_na=False).mean()
-        self.fig.add_trace(go.Scatter(y=ema, name=f'EMA{period}', line_color='#6a0dad'))
+        self.pipeline.add('ema', period)
+        self._fig = None
 
     def add_bb(self, period=20, deviations=2):
-        ma = self.df['Avg Price'].rolling(window=period).mean()
-        std_dev = self.df['Avg Price'].rolling(window=period).std()
-        self.fig.add_trace(go.Scatter(y=ma + (deviations * std_dev), name=f'BB Upper{period}', line_color='#7fe5f0'))
-        self.fig.add_trace(go.Scatter(y=ma - (deviations * std_dev), name=f'BB Lower{period}', line_color='#7fe5f0'))
+        self.pipeline.add('bb', period, deviations)
+        self._fig = None
 
     def add_rollingvwap(self, period=10):
-        rpv = (self.df['Avg Price'] * self.df['Volume']).rolling(window=period).sum()
-        rv = self.df['Volume'].rolling(window=period).sum()
-        vwap = rpv / rv
-        self.fig.add_trace(go.Scatter(y=vwap, name=f'Rolling VWAP{period}', line_color='#ef4135'))
+        self.pipeline.add('vwap', period)
+        self._fig = None
 
     def add_linregress(self):
-        cov = self.df.cov()['Index']['Avg Price']
-        var = self.df.var()['Index']
-        slope = cov / var
-        intercept = self.df['Avg Price'].mean() - (self.df['Index'].mean() * slope)
-        regression = self.df['Index'] * slope + intercept
-        self.fig.add_trace(
-            go.Scatter(y=regression, name=f'Linear Regression (y={round(slope, 4)}x + {round(intercept, 2)})',
-                       line_color='#ffa500'))
-
-    def spedscat(self):
-        self.df['PC'] = self.df['Avg Price'].pct_change()
+        self.pipeline.add('linregress')
+        self._fig = None
+
+    # rolling (or expanding, window=None) correlation and beta of volume on pct change for this ticker,
+    # as arrays over self.df's rows (see volret.relation; zero-volume days are left out)
+    def volume_return(self, window=None, min_periods=None):
+        return volret.relation(self.df['Pct Change'].to_numpy(), self.df['Volume'].to_numpy(), window, min_periods)
+
+    # full-history scatter of volume against pct change with its regression line
+    # the fit is the last row of the expanding volume_return(), so days without volume are left out of it
+    # (and of the scatter) instead of counting as zero volume
+    @timed()
+    def spedscat(self, queue=None):
+        import plotly.graph_objects as go
+
+        self.df['PC'] = self.df['Pct Change']
         adjuster = self.df['Volume'].max() / self.df['PC'].max()
         self.df['volp'] = self.df['Volume']/adjuster
 
         print(adjuster)
 
-        fig = go.Figure(data=go.Scatter(x=self.df['PC'], y=self.df['volp'], mode='markers'))
+        traded = self.df[self.df['Volume'] > 0]
+        fig = go.Figure(data=go.Scatter(x=traded['PC'], y=traded['volp'], mode='markers'))
         fig.update_layout(
             xaxis_title=self.ticker,
             yaxis_title=f'volume / adj. factor ({round(adjuster)})',
         )
-        cov = self.df.cov()['volp']['PC']
-        var = self.df.var()['volp']
-        slope = cov / var
-        intercept = self.df['volp'].mean() - (self.df['PC'].mean() * slope)
-        regression = self.df['PC'] * slope + intercept
+        scatter = {name: values[-1, 0] for name, values in self.volume_return().items()}
+        # the line is fitted to raw volume; the plot shows volume / adjuster
+        slope, intercept = scatter['beta'] / adjuster, scatter['intercept'] / adjuster
+        regression = intercept + slope * self.df['PC']
         print(f'{self.ticker} y={round(slope,6)}x + {round(intercept,4)}')
-        print(f'{self.ticker} correlation {self.df.corr()["PC"]["volp"]}')
-        self.fig.add_trace(
-            go.Scatter(y=regression, name=f'Linear Regression (y={round(slope, 6)}x + {round(intercept, 2)})',
-                       line_color='#ffa500'))
-        fig.write_image(f'{self.ticker}adjVolcorr.png')
+        print(f'{self.ticker} correlation {scatter["corr"]}')
+        self.traces.append(
+            dict(y=regression, name=f'Linear Regression (y={round(slope, 6)}x + {round(intercept, 2)})',
+                 line_color='#ffa500'))
+        self._fig = None
+        export(fig, f'{self.ticker}adjVolcorr.png', queue)
 
 ########################################################################################################################
 
 
+# scatter of y against x with the fitted line (and +/- sqrt(cov) bands when costand > 0)
+def scatter_plot(x, y, ticker1, ticker2, scatter, costand=0):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=go.Scatter(x=x, y=y, mode='markers'))
+    cov, slope, intercept = scatter.cov, scatter.slope, scatter.intercept
+    regression = scatter.line(x)
+    fig.add_trace(
+        go.Scatter(y=regression, x=x,
+                   name=f'Linear Regression (y={round(slope, 4)}x + {round(intercept, 4)})',
+                   line_color='#ffa500'))
+    fig.update_layout(
+        xaxis_title=ticker1,
+        yaxis_title=ticker2,
+    )
+
+    if costand > 0:
+        costd = math.sqrt(cov)
+        fig.add_trace(go.Scatter(y=regression+costd, x=x))
+        fig.add_trace(go.Scatter(y=regression-costd, x=x))
+    return fig
+
+
 class Correlate:
 
     def __init__(self, ticker1, ticker2, period=None):
@@ -102,54 +228,28 @@ class Correlate:
         self.ticker2 = ticker2
         self.period = period
 
-        self.df1 = pd.read_csv(f'{self.ticker1}.csv')
-        if self.period is not None:
-            self.df1 = self.df1.tail(self.period)
-        self.df1['Avg Price'] = (self.df1['High'] + self.df1['Low'] + self.df1['Close']) / 3
-        self.df2 = pd.read_csv(f'{self.ticker2}.csv')
+        # pct change of each (against its own previous session), lined up on the days both traded
+        aligned = Aligned([self.ticker1, self.ticker2], fields=['Pct Change'])
+        changes = aligned.column('Pct Change')
+        self.pchange = pd.DataFrame({'Date': aligned.dates, self.ticker1: changes[:, 0], self.ticker2: changes[:, 1]})
         if self.period is not None:
-            self.df2 = self.df2.tail(self.period)
-        self.df2['Avg Price'] = (self.df2['High'] + self.df2['Low'] + self.df2['Close']) / 3
-        column = ['Date']
-        self.pchange = pd.DataFrame(columns=column)
-        temp1 = self.pchange
-        temp2 = temp1
-        temp1['Date'] = self.df1['Date']
-        temp2['Date'] = self.df2['Date']
-        self.pchange[self.ticker1] = self.df1['Avg Price'].pct_change()
-        temp2[self.ticker2] = self.df2['Avg Price'].pct_change()
-        self.pchange.merge(temp2, on='Date')
-
-    def get_scatplot(self, costand=0):
-        fig = go.Figure(data=go.Scatter(x=self.pchange[self.ticker1], y=self.pchange[self.ticker2], mode='markers'))
-        cov = self.pchange.cov()[self.ticker1][self.ticker2]
-        var = self.pchange.var()[self.ticker1]
-        slope = cov / var
-        intercept = self.pchange[self.ticker2].mean() - (self.pchange[self.ticker1].mean() * slope)
-        regression = self.pchange[self.ticker1] * slope + intercept
-        fig.add_trace(
-            go.Scatter(y=regression, x=self.pchange[self.ticker1],
-                       name=f'Linear Regression (y={round(slope, 4)}x + {round(intercept, 4)})',
-                       line_color='#ffa500'))
-        fig.update_layout(
-            xaxis_title=self.ticker1,
-            yaxis_title=self.ticker2,
-        )
+            self.pchange = self.pchange.tail(self.period)
+        self.moments = {}
 
-        if costand > 0:
-            costd = math.sqrt(cov)
-            fig.add_trace(go.Scatter(y=regression+costd, x=self.pchange[self.ticker1]))
-            fig.add_trace(go.Scatter(y=regression-costd, x=self.pchange[self.ticker1]))
-        fig.write_image(f'{self.ticker1}_{self.ticker2}_corr.png')
+    def get_scatplot(self, costand=0, queue=None):
+        scatter = fit(self.moments, self.pchange, self.ticker1, self.ticker2)
+        fig = scatter_plot(self.pchange[self.ticker1], self.pchange[self.ticker2], self.ticker1, self.ticker2,
+                           scatter, costand)
+        export(fig, f'{self.ticker1}_{self.ticker2}_corr.png', queue)
 
     def get_corr(self):
-        return self.pchange.corr()[self.ticker1][self.ticker2]
-
-stonks = ['^DJI', '^GSPC', '^IXIC', '^NYA']
-#for s in stonks:
-#    for x in stonks:
-#        a = Correlate(s, x)
-#        a.get_scatplot()
-for tick in stonks:
-    a = Graph(ticker=tick)
-    a.spedscat()
\ No newline at end of file
+        return fit(self.moments, self.pchange, self.ticker1, self.ticker2).corr
+
+if __name__ == '__main__':
+    stonks = ['^DJI', '^GSPC', '^IXIC', '^NYA']
+    # every pair at once, each ticker loaded a single time (see matrix.correlation_matrix)
+    #results = correlation_matrix(stonks, plots=True)
+    with RenderQueue() as queue:
+        for tick in stonks:
+            a = Graph(ticker=tick)
+            a.spedscat(queue)
\ No newline at end of file
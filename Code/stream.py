@@ -0,0 +1,174 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import loader
+from incremental import Indicators
+from profiler import count
+from stats import Summary
+
+CHUNKSIZE = 100_000
+
+
+# byte offset where the data rows start (just after the header line)
+def data_start(f):
+    f.seek(0)
+    f.readline()
+    return f.tell()
+
+
+# start of the first line at or after byte `pos`
+def next_line(f, pos, start):
+    if pos <= start:
+        return start
+    f.seek(pos - 1)
+    return pos - 1 + len(f.readline())
+
+
+# byte offset of the first row dated on or after `date`, by binary search over the file
+# rows are sorted by their leading date; each probed one is parsed like the column store parses it, so an
+# intraday `date` finds its minute rather than the start of its day
+def find_date(path, date):
+    target = np.datetime64(pd.Timestamp(date))
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = data_start(f)
+
+        # True once the line starting at or after `pos` is on/after the target (or there is no such line)
+        def after(pos):
+            line = next_line(f, pos, start)
+            if line >= size:
+                return True
+            f.seek(line)
+            return loader.parse_dates([f.readline().split(b',', 1)[0].decode()])[0] >= target
+
+        lo, hi = start, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if after(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return next_line(f, lo, start)
+
+
+# byte offset of the start of the last `rows` rows before byte `until` (a line start, default the end of the
+# file), found by scanning backwards in blocks
+# yahoo's null placeholder rows are not counted, since the column store and chunks() drop them;
+# nulls=True counts them like any other line
+def tail_offset(path, rows, until=None, nulls=False, block=1 << 16):
+    size = os.path.getsize(path) if until is None else until
+    with open(path, 'rb') as f:
+        start = data_start(f)
+        pos = size
+        # start of the line cut by the previous block's lower edge, finished by the next block
+        carry = b''
+        found = 0
+        while pos > start:
+            step = min(block, pos - start)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + carry
+            lines = data.split(b'\n')
+            # the first piece is only known to be a whole line once the data start is reached
+            whole = lines if pos == start else lines[1:]
+            carry = b'' if pos == start else lines[0]
+            end = pos + len(data)
+            for line in reversed(whole):
+                begin = end - len(line)
+                if line.strip() and (nulls or b'null' not in line):
+                    found += 1
+                    if found == rows:
+                        return begin
+                end = begin - 1
+        return start
+
+
+# byte range [offset, stop) of the rows between start and end (both found by seeking, not by reading up to
+# them), narrowed to the last `period` rows of that range, like Graph's in-memory path; end as a Timestamp
+def span(path, start=None, end=None, period=None):
+    with open(path, 'rb') as f:
+        offset = data_start(f)
+    stop = os.path.getsize(path)
+    if start is not None:
+        offset = max(offset, find_date(path, start))
+    if end is not None:
+        end = pd.Timestamp(end)
+        stop = find_date(path, end.normalize() + pd.Timedelta(days=1))
+    if period is not None:
+        offset = max(offset, tail_offset(path, period, stop))
+    return offset, stop, end
+
+
+# typed frames of at most `chunksize` rows from a csv in the Data/*.csv schema, never holding the whole file
+# the rows are those of span(): a date range, then the last `period` rows of it
+# an empty selection still yields one empty (typed) frame, so the chunks can always be concatenated
+def chunks(path, chunksize=CHUNKSIZE, start=None, end=None, period=None):
+    return read_span(path, *span(path, start, end, period), chunksize)
+
+
+def read_span(path, offset, stop, end=None, chunksize=CHUNKSIZE):
+    empty = True
+    if offset < stop:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            reader = pd.read_csv(f, header=None, names=list(loader.COLUMNS), na_values=['null'],
+                                 chunksize=chunksize)
+            for df in reader:
+                df = _typed(df.dropna())
+                count('rows streamed', len(df))
+                if end is not None and len(df) and df['Date'].iloc[-1] > end:
+                    df = df[df['Date'] <= end]
+                    if len(df):
+                        empty = False
+                        yield df.reset_index(drop=True)
+                    break
+                if len(df):
+                    empty = False
+                    yield df.reset_index(drop=True)
+    if empty:
+        yield pd.DataFrame({column: np.empty(0, dtype) for column, dtype in loader.COLUMNS.items()})
+
+
+# avg prices of the (at most) `rows` rows just before byte `offset`, nulls left out
+def avg_before(path, offset, rows=2):
+    begin = tail_offset(path, rows, offset)
+    if begin >= offset:
+        return np.empty(0)
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(offset - begin)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=list(loader.COLUMNS), na_values=['null']).dropna()
+    return ((df['High'] + df['Low'] + df['Close']) / 3).to_numpy()
+
+
+def _typed(df):
+    df['Date'] = loader.parse_dates(df['Date'])
+    df['Volume'] = df['Volume'].astype(np.int64)
+    return df
+
+
+# chunks with avg price, pct change, up day, same direction and any indicators requested, carried across chunks
+# so the values match a full in-memory computation; indicator settings are Indicators' (sma, ema, bb, vwap)
+# pct change, up day and same direction continue from the rows before the range, like the column store's;
+# the window indicators start with the range, like Graph's
+def indicators(path, chunksize=CHUNKSIZE, start=None, end=None, period=None, sma=(), ema=(), bb=(), vwap=()):
+    state = Indicators(sma=sma, ema=ema, bb=bb, vwap=vwap)
+    offset, stop, end = span(path, start, end, period)
+    state.seed(avg_before(path, offset))
+    for df in read_span(path, offset, stop, end, chunksize):
+        out = state.update(df['High'].to_numpy(), df['Low'].to_numpy(), df['Close'].to_numpy(),
+                           df['Volume'].to_numpy())
+        yield df.assign(**out)
+
+
+# single streaming pass summary (stats.Summary) of one column; summaries of chunks or files can be merged
+# nonzero=True leaves zeros out, like the volume summaries
+def summarize(path, column, chunksize=CHUNKSIZE, start=None, end=None, period=None, nonzero=False):
+    summary = Summary()
+    for df in indicators(path, chunksize, start, end, period):
+        values = df[column].to_numpy(np.float64)
+        summary.update(values[values != 0] if nonzero else values)
+    return summary
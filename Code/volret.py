@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+import loader
+from matrix import union_block
+from ols import comoments
+from rolling import RollingSums, prefix_sums, window_sums
+
+OUTPUTS = ('corr', 'beta', 'intercept', 'n')
+
+
+# volume against pct change for every column of two days x tickers arrays at once (Graph.spedscat's
+# regression generalized): rolling over `window` rows, or expanding (every row so far) when window is None
+# corr is pearson's r, beta / intercept the least-squares line volume = intercept + beta * pct change
+# a day with zero volume (early index history, holidays) is missing rather than a real 0, as is any NaN;
+# a window needs `min_periods` usable days (default: all of them rolling, 2 expanding)
+# returns days x tickers arrays keyed by OUTPUTS (n = usable days in the window), NaN until there are enough
+def relation(returns, volume, window=None, min_periods=None):
+    returns = np.asarray(returns, dtype=np.float64).reshape(len(returns), -1)
+    volume = np.asarray(volume, dtype=np.float64).reshape(len(volume), -1)
+    volume = np.where(volume > 0, volume, np.nan)
+    if min_periods is None:
+        min_periods = 2 if window is None else window
+    days, tickers = returns.shape
+    out = {}
+
+    # centred on each column's mean over its usable days (see ols.comoments)
+    valid = ~(np.isnan(returns) | np.isnan(volume))
+    used = np.maximum(valid.sum(axis=0), 1)
+    shift_x = np.where(valid, returns, 0.0).sum(axis=0) / used
+    shift_y = np.where(valid, volume, 0.0).sum(axis=0) / used
+    x, y = returns - shift_x, volume - shift_y
+    if window is None:
+        prefix, counts = prefix_sums(x, y)
+        (sx, sy, sxx, syy, sxy), n = window_sums(prefix, counts)
+    else:
+        # a window's sums are not taken as a difference of prefix sums here: volume grew ~1000x over the
+        # index histories, and differences of the huge late prefixes wash out the early windows' variance
+        # (~1e-6 error in r), so the windows are kept with RollingSums' compensated ring buffer instead
+        x, y = np.where(valid, x, np.nan), np.where(valid, y, np.nan)
+        sums, counts = RollingSums(window, 5 * tickers).update(np.hstack([x, y, x * x, y * y, x * y]))
+        sx, sy, sxx, syy, sxy = sums.reshape(days, 5, tickers).transpose(1, 0, 2)
+        n = counts[:, :tickers]
+
+    _, var_x, var_y, corr, beta = comoments(sx, sy, sxx, syy, sxy, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intercept = (sy / n + shift_y) - beta * (sx / n + shift_x)
+    usable = (n >= min_periods) & (var_x > 0)
+    out['corr'] = np.where(usable & (var_y > 0), corr, np.nan)
+    out['beta'] = np.where(usable, beta, np.nan)
+    out['intercept'] = np.where(usable, intercept, np.nan)
+    out['n'] = n
+    return out
+
+
+# pct change and volume of every ticker on the union of their trading days (NaN where one did not trade)
+def load(tickers, directory='.', period=None):
+    days, returns = union_block(tickers, directory, period)
+    _, volume = union_block(tickers, directory, period, field='Volume')
+    return days, returns, volume
+
+
+# relation() for tickers straight from their csvs, as one frame per output (dates x tickers)
+def frames(tickers, window=None, directory='.', period=None, min_periods=None):
+    days, returns, volume = load(tickers, directory, period)
+    out = relation(returns, volume, window, min_periods)
+    index = pd.Index(days.astype('datetime64[D]').astype(loader.COLUMNS['Date']), name='Date')
+    return {name: pd.DataFrame(values, index=index, columns=list(tickers), copy=False) for name, values in out.items()}
+
+
+# latest value of every output per ticker (each ticker's own last trading day), for screening
+def screen(tickers, window=None, directory='.', period=None, min_periods=None):
+    days, returns, volume = load(tickers, directory, period)
+    out = relation(returns, volume, window, min_periods)
+    # last row each ticker traded on
+    last = len(days) - 1 - np.argmax(~np.isnan(returns[::-1]), axis=0)
+    columns = np.arange(len(tickers))
+    table = pd.DataFrame({name: values[last, columns] for name, values in out.items()}, index=list(tickers))
+    table['n'] = table['n'].astype(np.int64)
+    return table